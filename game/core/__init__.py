@@ -1,12 +1,16 @@
 from game.core.handler import RoomHandler
+from game.core.store import get_room_store
+from game.core.identity import get_identity_store
+from game.core.timer import get_phase_deadlines
+from game.core.sweeper import get_room_ttls
+from game.core.history import get_game_archive
+from game.core.gamelog import get_game_log
 from game.core.job import *
+from game.core.naming import name_generator
 
-room_container = RoomHandler()
-job_list = [
-    Citizen.__name__.lower(),
-    Police.__name__.lower(),
-    Doctor.__name__.lower(),
-    Mafia.__name__.lower()
-]
+room_container = RoomHandler(get_room_store(), get_phase_deadlines(), get_room_ttls(), get_game_archive(),
+                             get_game_log())
+identity_store = get_identity_store()
+job_list = list(JOBS)
 
-__all__ = ['room_container', 'job_list']
+__all__ = ['room_container', 'identity_store', 'job_list', 'name_generator']
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+
+logger = logging.getLogger('mafia')
+
+
+class Command:
+    """Queued mutation of a room
+
+    Attributes:
+        mutate {callable} -- called with room, must change nothing but the room
+        effect {coroutine function} -- called with room and result of mutate after room is saved
+        create {bool} -- create room when it does not exist
+        check {bool} -- check phase completion after the batch
+        touch {bool} -- counts as activity of room users, for room sweeper
+        future {asyncio.Future} -- resolved with result of effect (or mutate without effect)
+    """
+
+    def __init__(self, mutate, effect=None, create=False, check=False, touch=True):
+        self.mutate = mutate
+        self.effect = effect
+        self.create = create
+        self.check = check
+        self.touch = touch
+        self.future = asyncio.get_event_loop().create_future()
+
+    def resolve(self, result=None, error=None):
+        if self.future.done():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+
+
+class RoomActor:
+    """Apply commands of a room in order, from its own task
+
+    Commands queued while a batch is applied (or in the same tick) are applied
+    together as the next batch. The task stops when the inbox is empty, so idle
+    rooms do not keep tasks.
+
+    Arguments:
+        room_key {str} -- room key
+        apply {coroutine function} -- called with room key and list of commands
+        on_idle {callable} -- called with actor when it stops
+    """
+
+    def __init__(self, room_key, apply, on_idle):
+        self.room_key = room_key
+        self.apply = apply
+        self.on_idle = on_idle
+        self.inbox = []
+        self.task = asyncio.ensure_future(self.run())
+
+    def submit(self, command):
+        self.inbox.append(command)
+        return command.future
+
+    async def run(self):
+        try:
+            while self.inbox:
+                batch, self.inbox = self.inbox, []
+                try:
+                    await self.apply(self.room_key, batch)
+                except Exception as e:
+                    logger.exception('Failed to apply commands to room {}'.format(self.room_key))
+                    for command in batch:
+                        command.resolve(error=e)
+        finally:
+            # no await between the last inbox check and here
+            self.on_idle(self)
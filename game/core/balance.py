@@ -0,0 +1,180 @@
+import time
+from math import factorial
+import numpy as np
+from game.core.simulation import Simulation
+
+# rows of alive count arrays, each game is a column
+CITIZEN, POLICE, DOCTOR, MAFIA = range(4)
+JOB_CODES = {
+    'citizen': CITIZEN,
+    'police': POLICE,
+    'doctor': DOCTOR,
+    'mafia': MAFIA,
+}
+
+
+def comb(n, k):
+    return factorial(n) // (factorial(k) * factorial(n - k))
+
+
+class BalanceAnalyzer:
+    """Estimate win probabilities of a job composition with batched games
+
+    Plays the games of `Simulation` with `RandomBot`, but a batch of games is
+    kept as a numpy array of alive count by job instead of `Room` objects.
+    Random bots choose evenly, so who dies is an even pick of alive users and
+    only the counts matter:
+
+    - day: alive users vote election or night, dead users vote nothing, most
+      votes wins and ties go to the option voted first
+    - election: alive users vote an alive user or nobody, a user is executed
+      with more than half of the votes
+    - night: doctor saves and mafia kills an alive user, police only learns
+    - after every phase, `CitizenGroup` wins when no mafia can act and
+      `MafiaGroup` wins when acting mafia are at least half of acting users
+
+    Arguments:
+        players {int} -- number of players
+
+    Keyword Arguments:
+        jobs {dict} -- count by job name, rest of players are citizens (default: {None})
+        games {int} -- number of games to play (default: {100000})
+        seed {int} -- seed of random generator (default: {None})
+        phase_limit {int} -- phases before a game is counted as draw (default: {200})
+        batch {int} -- games played at once, bounds memory (default: {1000000})
+    """
+
+    def __init__(self, players, jobs=None, games=100000, seed=None, phase_limit=200, batch=1000000):
+        self.players = players
+        self.jobs = Simulation.compose(players, jobs)
+        self.games = games
+        self.phase_limit = phase_limit
+        self.batch = batch
+        self.rng = np.random.RandomState(seed)
+        self.counts = np.zeros(len(JOB_CODES), dtype=np.int16)
+        for job, count in self.jobs.items():
+            if job not in JOB_CODES:
+                raise ValueError('job {} is not played by balance analyzer'.format(job))
+            self.counts[JOB_CODES[job]] = count
+        self.elections = self.election_odds(players)
+        self.executions = self.execution_odds(players)
+
+    @classmethod
+    def election_odds(cls, players):
+        """Probability of going to election by alive count
+
+        `alive` users vote election or night evenly and the rest vote nothing.
+        Tied options have the same number of votes, so each of them has the
+        same chance of being voted first.
+        """
+        odds = np.zeros(players + 1)
+        for alive in range(players + 1):
+            for election in range(alive + 1):
+                votes = [election, alive - election, players - alive]
+                if election == max(votes):
+                    odds[alive] += comb(alive, election) / 2 ** alive / votes.count(election)
+        return odds
+
+    @classmethod
+    def execution_odds(cls, players):
+        """Probability of execution in election by alive count
+
+        `alive` users vote one of `alive` users or nobody evenly, and dead users
+        vote nobody. Only one user can have more than half of the alive votes,
+        and the user is executed when nobody has fewer votes. Ties go to the
+        option voted first, which is either of them evenly.
+        """
+        odds = np.zeros(players + 1)
+        for alive in range(1, players + 1):
+            dead = players - alive
+            p = 1 / (alive + 1)
+            for k in range(alive // 2 + 1, alive + 1):
+                # the others vote nobody or one of the other users
+                nobody = 0
+                for abstain in range(alive - k + 1):
+                    others = alive - k
+                    chance = comb(others, abstain) * (1 / alive) ** abstain * (1 - 1 / alive) ** (others - abstain)
+                    if dead + abstain < k:
+                        nobody += chance
+                    elif dead + abstain == k:
+                        nobody += chance / 2
+                odds[alive] += alive * comb(alive, k) * p ** k * (1 - p) ** (alive - k) * nobody
+        return odds
+
+    def run(self):
+        """Play all games
+
+        Returns:
+            dict -- win probability by group, 'draw' for games exceeding phase limit
+        """
+        started = time.perf_counter()
+        wins = np.zeros(3, dtype=np.int64)
+        remaining = self.games
+        while remaining > 0:
+            size = min(self.batch, remaining)
+            wins += self.play(size)
+            remaining -= size
+        return {
+            'players': self.players,
+            'jobs': self.jobs,
+            'games': self.games,
+            'seconds': time.perf_counter() - started,
+            'wins': {
+                'citizen_group': float(wins[0] / self.games),
+                'mafia_group': float(wins[1] / self.games),
+                'draw': float(wins[2] / self.games),
+            },
+        }
+
+    def play(self, size):
+        """Play a batch of games
+
+        Returns:
+            numpy.ndarray -- number of citizen wins, mafia wins and draws
+        """
+        counts = np.repeat(self.counts[:, None], size, axis=1)
+        # proceeded phases of each game, waiting room proceeds to day first
+        phases = np.ones(size, dtype=np.int32)
+        wins = np.zeros(3, dtype=np.int64)
+
+        def check(counts, phases):
+            # finished games and games at phase limit leave the batch
+            mafia = counts[MAFIA]
+            citizen_won = mafia == 0
+            mafia_won = ~citizen_won & (mafia * 2 >= counts.sum(axis=0))
+            wins[0] += citizen_won.sum()
+            wins[1] += mafia_won.sum()
+            playing = ~(citizen_won | mafia_won)
+            wins[2] += (playing & (phases >= self.phase_limit)).sum()
+            playing &= phases < self.phase_limit
+            return counts[:, playing], phases[playing]
+
+        counts, phases = check(counts, phases)
+        while len(phases):
+            alive = counts.sum(axis=0)
+            election = self.rng.random_sample(len(phases)) < self.elections[alive]
+            # nobody dies during day, no need to check
+            phases += 1
+            election &= phases < self.phase_limit
+            executed = election & (self.rng.random_sample(len(phases)) < self.executions[alive])
+            self.kill(counts, executed)
+            phases[election] += 1
+            counts, phases = check(counts, phases)
+            if len(phases):
+                # mafia target is saved when the doctor picks the same user
+                alive = counts.sum(axis=0)
+                saved = (counts[DOCTOR] > 0) & (self.rng.random_sample(len(phases)) * alive < 1)
+                self.kill(counts, ~saved)
+                phases += 1
+                counts, phases = check(counts, phases)
+        return wins
+
+    def kill(self, counts, games):
+        """Kill an even pick of alive users in given games
+        """
+        games = np.flatnonzero(games)
+        alive = counts[:, games].cumsum(axis=0)
+        pick = (self.rng.random_sample(len(games)) * alive[-1]).astype(alive.dtype)
+        # number of jobs whose users are all before the picked one
+        job = (alive <= pick).sum(axis=0)
+        counts[job, games] -= 1
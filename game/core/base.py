@@ -1,3 +1,4 @@
+import json
 import logging
 from enum import Enum
 
@@ -10,16 +11,62 @@ class User:
         ALIVE = 'alive'
         SAVED = 'saved'
 
+    # thousands of users are resident, keep them without __dict__
+    __slots__ = ('key', '_name', 'channel_name', 'room_status', '_status', '_connected', 'job', '_dict', '_json')
+
     def __init__(self, user_key, user_name, channel_name):
         self.key = user_key
-        self.name = user_name
+        # serialized forms, dropped whenever a serialized field changes
+        self._dict = None
+        self._json = None
+        self._name = user_name
         self.channel_name = channel_name
-        self.status = User.Status.ALIVE
-        self.connected = True
+        # room status keeping counters of this user, notified on status changes
+        self.room_status = None
+        # index of _USER_STATUSES
+        self._status = _ALIVE
+        self._connected = True
         self.job = None
 
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
+        self.changed()
+
+    @property
+    def status(self):
+        return _USER_STATUSES[self._status]
+
+    @status.setter
+    def status(self, status):
+        active = self.can_act()
+        self._status = _USER_STATUS_CODES[status]
+        self.changed()
+        if self.room_status is not None:
+            self.room_status.user_changed(self, active)
+
+    @property
+    def connected(self):
+        return self._connected
+
+    @connected.setter
+    def connected(self, connected):
+        active = self.can_act()
+        self._connected = connected
+        self.changed()
+        if self.room_status is not None:
+            self.room_status.user_changed(self, active)
+
+    def changed(self):
+        self._dict = None
+        self._json = None
+
     def can_act(self):
-        return self.status != User.Status.DEAD and self.connected
+        return self._status != _DEAD and self._connected
 
     def executed(self):
         self.status = User.Status.DEAD
@@ -27,7 +74,7 @@ class User:
     def clear_temporary_status(self):
         if self.status == User.Status.SAVED:
             self.status = User.Status.ALIVE
-        if self.Status != User.Status.DEAD and not self.connected:
+        if self.status != User.Status.DEAD and not self.connected:
             self.status = User.Status.DEAD
     
     def init_status(self):
@@ -35,14 +82,60 @@ class User:
         self.status = User.Status.ALIVE
 
     def dict(self):
+        """Public fields of user, cached until they change
+
+        Returned dict is shared, copy it before changing it.
+        """
+        if self._dict is None:
+            self._dict = {
+                'id': self.key,
+                'name': self._name,
+                'status': self.status.value,
+                'connected': self._connected,
+                # 'job': self.job.name() if self.job else None
+            }
+        return self._dict
+
+    def json(self):
+        """`dict` encoded as json, cached until it changes
+        """
+        if self._json is None:
+            self._json = json.dumps(self.dict())
+        return self._json
+
+    def dump(self):
+        """Serialize full user state for room stores
+        """
         return {
-            'id': self.key,
+            'key': self.key,
             'name': self.name,
+            'channel_name': self.channel_name,
             'status': self.status.value,
             'connected': self.connected,
-            # 'job': self.job.name() if self.job else None
+            'job': self.job.name() if self.job else None,
         }
 
+    @classmethod
+    def load(cls, data, jobs=None):
+        """Restore user from `dump` result
+
+        Arguments:
+            data {dict} -- dumped user
+            jobs {dict} -- job instances by job name, shared in a room
+        """
+        user = cls(data['key'], data['name'], data['channel_name'])
+        user.status = User.Status(data['status'])
+        user.connected = data['connected']
+        if data['job'] is not None and jobs is not None:
+            user.job = jobs.get(data['job'])
+        return user
+
+
+# statuses are kept as indexes of these tuples
+_USER_STATUSES = tuple(User.Status)
+_USER_STATUS_CODES = {status: code for code, status in enumerate(_USER_STATUSES)}
+_DEAD, _ALIVE, _SAVED = range(len(_USER_STATUSES))
+
 
 class Choice:
     class Status(str, Enum):
@@ -50,14 +143,43 @@ class Choice:
         TMP = 'tmp'
         FIXED = 'fixed'
 
+    __slots__ = ('user', '_status', '_target', '_user_dict', '_user_json', '_cached_of')
+
     def __init__(self, user):
         self.user = user
-        self.status = Choice.Status.YET
-        self.target = None
+        # index of _CHOICE_STATUSES
+        self._status = _YET
+        self._target = None
+        # serialized forms, with cached dict of user they are built from
+        self._user_dict = None
+        self._user_json = None
+        self._cached_of = None
+
+    @property
+    def status(self):
+        return _CHOICE_STATUSES[self._status]
+
+    @status.setter
+    def status(self, status):
+        self._status = _CHOICE_STATUS_CODES[status]
+        self._cached_of = None
+
+    @property
+    def target(self):
+        return self._target
+
+    @target.setter
+    def target(self, target):
+        self._target = target
+        self._cached_of = None
 
     def choose(self, target, status):
-        self.target = target
-        self.status = status
+        self._target = target
+        self._status = _CHOICE_STATUS_CODES[status]
+        self._cached_of = None
+
+    def fixed(self):
+        return self._status == _FIXED
 
     def dict(self):
         return {
@@ -66,6 +188,39 @@ class Choice:
         }
 
     def user_dict(self):
-        result = self.user.dict()
-        result['choice'] = self.dict()
-        return result
+        """User with its choice, cached until either of them changes
+
+        Returned dict is shared, copy it before changing it.
+        """
+        user_dict = self.user.dict()
+        if self._cached_of is not user_dict:
+            self._user_dict = dict(user_dict, choice=self.dict())
+            self._user_json = None
+            self._cached_of = user_dict
+        return self._user_dict
+
+    def user_json(self):
+        """`user_dict` encoded as json, cached until it changes
+        """
+        user_dict = self.user_dict()
+        if self._user_json is None:
+            self._user_json = json.dumps(user_dict)
+        return self._user_json
+
+    def dump(self):
+        return {
+            'user': self.user.key,
+            'target': self.target,
+            'status': self.status.value,
+        }
+
+    @classmethod
+    def load(cls, data, user):
+        choice = cls(user)
+        choice.choose(data['target'], Choice.Status(data['status']))
+        return choice
+
+
+_CHOICE_STATUSES = tuple(Choice.Status)
+_CHOICE_STATUS_CODES = {status: code for code, status in enumerate(_CHOICE_STATUSES)}
+_YET, _TMP, _FIXED = range(len(_CHOICE_STATUSES))
@@ -0,0 +1,9 @@
+def setting(name, default=None):
+    """Django setting, or default when it is not set or used without django project (e.g. simulations)
+    """
+    from django.conf import settings
+    from django.core.exceptions import ImproperlyConfigured
+    try:
+        return getattr(settings, name, default)
+    except ImproperlyConfigured:
+        return default
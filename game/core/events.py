@@ -0,0 +1,114 @@
+import json
+from collections import deque
+from game.socket import HandlerType
+
+
+class Encoded:
+    """Value of a message already encoded as json, e.g. joined cached fragments
+    """
+
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    @classmethod
+    def join(cls, fragments):
+        return cls('[' + ', '.join(fragments) + ']')
+
+
+def client_message(message):
+    """Message as the client receives it, like `GameConsumer.common_send` forwards it
+    """
+    if message['type'] != HandlerType.COMMON_SEND:
+        return message
+    forwarded = dict(message)
+    forwarded['type'] = forwarded.pop('ret_type')
+    return forwarded
+
+
+def encode(message):
+    """Encode client message as a websocket text frame
+
+    Top level `Encoded` values are spliced in as they are.
+    """
+    return '{' + ', '.join('{}: {}'.format(
+        json.dumps(key), value.text if isinstance(value, Encoded) else json.dumps(value)
+    ) for key, value in message.items()) + '}'
+
+
+def frame(message):
+    """Channel layer event sending encoded message, forwarded as is by `GameConsumer.frame_send`
+    """
+    return {
+        'type': HandlerType.FRAME_SEND,
+        'text': encode(client_message(message)),
+    }
+
+
+class EventLog:
+    """Recent events of a room, to resend what reconnecting clients missed
+
+    Events are numbered by `Room.event_seq` and kept as encoded text frames.
+    An event sent with different content to some users (e.g. phase changes)
+    is kept once per content with the same number. Such an event is meant for
+    every user, so a user missing from all of its contents (e.g. disconnected
+    when it was sent) needs full room information. Events applied by other
+    workers are not seen here, so a gap in numbers drops what was kept before it.
+
+    Keyword Arguments:
+        size {int} -- number of kept messages (default: {256})
+
+    Attributes:
+        last_seq {int} -- number of the last kept event
+        evicted_seq {int} -- highest number of events dropped from the buffer
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.events = deque()
+        self.last_seq = 0
+        self.evicted_seq = 0
+
+    def record(self, seq, message, users=None, variant=False):
+        """Keep event
+
+        Arguments:
+            seq {int} -- event number
+            message {str} -- encoded message as the client receives it
+
+        Keyword Arguments:
+            users {set} -- keys of receiving users, everyone in room when None (default: {None})
+            variant {bool} -- one content of an event meant for every user (default: {False})
+        """
+        if seq > self.last_seq + 1:
+            # events between were applied somewhere else
+            self.events.clear()
+            self.evicted_seq = seq - 1
+        self.last_seq = max(self.last_seq, seq)
+        self.events.append((seq, message, users, variant))
+        if len(self.events) > self.size:
+            evicted, _, _, _ = self.events.popleft()
+            self.evicted_seq = max(self.evicted_seq, evicted)
+
+    def since(self, seq, user_key):
+        """Events after `seq` sent to user
+
+        Returns:
+            list -- encoded messages in order, None when some of them are not kept
+        """
+        if seq < self.evicted_seq or seq > self.last_seq:
+            return None
+        messages = []
+        received, missed = set(), set()
+        for event_seq, message, users, variant in self.events:
+            if event_seq <= seq:
+                continue
+            if users is None or user_key in users:
+                messages.append(message)
+                received.add(event_seq)
+            elif variant:
+                missed.add(event_seq)
+        if missed - received:
+            return None
+        return messages
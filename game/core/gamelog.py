@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import msgpack
+from game.core.conf import setting
+
+logger = logging.getLogger('mafia')
+
+# big endian length of each packed record
+HEADER = struct.Struct('>I')
+
+
+def pack(record):
+    data = msgpack.packb(record, use_bin_type=True)
+    return HEADER.pack(len(data)) + data
+
+
+def unpack(stream):
+    """Records of a length prefixed stream, a torn record at the end is ignored
+    """
+    while True:
+        header = stream.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return
+        size, = HEADER.unpack(header)
+        data = stream.read(size)
+        if len(data) < size:
+            return
+        yield msgpack.unpackb(data, raw=False)
+
+
+def read_log(path):
+    """Records of a log file, oldest first
+    """
+    try:
+        with open(path, 'rb') as stream:
+            return list(unpack(stream))
+    except FileNotFoundError:
+        return []
+
+
+class GameLog:
+    """Append-only log of room commands, one file per room
+
+    Rooms journal every applied command as `[time, op, *args]` (see
+    `Room.record`), starting with a `create` record. Room keys are reused
+    after their rooms are deleted, so a file may hold several rooms and replays
+    start over at each `create`. Records are packed as length prefixed msgpack and written
+    in batches, `window` seconds after the first pending one, by a single
+    writer thread so files are appended in order.
+
+    Arguments:
+        directory {str} -- directory of log files
+
+    Keyword Arguments:
+        window {float} -- seconds records wait to be written together (default: {0.05})
+    """
+
+    def __init__(self, directory, window=0.05):
+        self.directory = directory
+        self.window = window
+        self.pending = {}
+        self.flush_handle = None
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, room_key):
+        return os.path.join(self.directory, '{}.log'.format(os.path.basename(room_key)))
+
+    def append(self, room_key, records):
+        """Queue records of room to be written
+        """
+        self.pending.setdefault(room_key, []).extend(pack(record) for record in records)
+        if self.flush_handle is None:
+            loop = asyncio.get_event_loop()
+            self.flush_handle = loop.call_later(self.window, lambda: asyncio.ensure_future(self.flush()))
+
+    async def flush(self):
+        """Write pending records, returns after they are written
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        pending, self.pending = self.pending, {}
+        if pending:
+            await asyncio.get_event_loop().run_in_executor(self.writer, self.write, pending)
+
+    def write(self, pending):
+        for room_key, records in pending.items():
+            try:
+                with open(self.path(room_key), 'ab') as stream:
+                    stream.write(b''.join(records))
+            except OSError:
+                logger.exception('Failed to write game log of room {}'.format(room_key))
+
+    def read(self, room_key):
+        """Written records of room, oldest first
+        """
+        return read_log(self.path(room_key))
+
+    def replay(self, room_key, until=None):
+        """Rebuild room from its records
+
+        Keyword Arguments:
+            until {int} -- number of records to apply, all when None (default: {None})
+
+        Returns:
+            Room -- room as it was after the applied records
+        """
+        from game.core.room import Room
+        return Room.replay(room_key, self.read(room_key)[:until])
+
+
+def get_game_log():
+    """Game log configured by `MAFIA_GAME_LOG` setting
+
+    Example:
+        MAFIA_GAME_LOG = {'directory': '/var/log/mafia/games', 'window': 0.05}
+
+    Returns:
+        GameLog -- None when commands are not logged
+    """
+    config = setting('MAFIA_GAME_LOG')
+    return GameLog(**config) if config is not None else None
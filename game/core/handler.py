@@ -1,145 +1,327 @@
+import asyncio
+import random
+import time
 from game.core.base import *
-from game.core.room_status import RoomStatus
 from game.core.room_processor import *
+from game.core.store import MemoryRoomStore, RoomConflictError, Unchanged
+from game.core.actor import Command, RoomActor
+from game.core.events import Encoded, EventLog, frame
+from game.core.lobby import LobbyIndex
+from game.core.naming import name_generator
+from game.core.timer import DeadlineTimer
+from game.core.sweeper import RoomSweeper
 from channels.layers import get_channel_layer
 from game.socket import HandlerType
 
 
-class Room:
-
-    DELEGATION_METHOD = [
-        'get_user',
-        'add_user',
-        'remove_user',
-        'get_user_list',
-        'get_choice_list',
-        'reconnect_user',
-        'disconnect_user',
-        'choose',
-        'add_job',
-        'remove_job',
-        'get_job_list',
-        'result',
-        'done',
-        'get_type',
-    ]
-
-    def __init__(self, room_key, users=None):
-        self.status = RoomStatus(room_key, users)
-        self.phases = [WaitingRoom(self.status)]
-        self.cur_phase = self.phases[0]
-
-    def __getattr__(self, method):
-        if method in Room.DELEGATION_METHOD:
-            return getattr(self.cur_phase, method)
-        raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, method))
-
-    def can_target(self, user, target):
-        return self.cur_phase.choose_limit(user, target.key, Choice.Status.FIXED)
-
-    def next_phase(self):
-        self.cur_phase = self.cur_phase.next_phase()
-        self.phases.append(self.cur_phase)
-
-    def game_done(self):
-        result = self.cur_phase.game_done()
-        if result is not None:
-            self.status = RoomStatus(self.status.room_key, [user for user in self.status.users if user.connected]
-                                     , self.status.jobs)
-            for user in self.status.users:
-                user.init_status()
-            self.cur_phase = WaitingRoom(self.status)
-            self.phases.append(self.cur_phase)
-        return result
-
-    def type(self):
-        return type(self.cur_phase)
+class CommandFailed(Exception):
+    """Command raised while mutating a room, its batch is applied again without it
+    """
+    pass
 
 
 class RoomHandler:
 
-    def __init__(self):
+    def __init__(self, store=None, deadlines=None, ttls=None, archive=None, game_log=None):
         logger.debug('RoomContainer initiated.')
-        self.room_map = {}
-
-    def room_exists(self, room_key):
-        return room_key in self.room_map
+        self.store = store if store is not None else MemoryRoomStore()
+        self.actors = {}
+        self.lobby = LobbyIndex(self)
+        self.event_logs = {}
+        # seconds by room type, phases without deadline wait for every user
+        self.deadlines = deadlines if deadlines is not None else {}
+        self.timer = DeadlineTimer()
+        self.timers = {}
+        # rooms are kept until their users leave when ttls are not given
+        self.sweeper = RoomSweeper(self, **ttls) if ttls is not None else None
+        # called with room key and each game rotated out of room history
+        self.archive = archive
+        # balance reports by job composition
+        self.balances = {}
+        # GameLog appending commands applied to rooms
+        self.game_log = game_log
+        # rooms created here get seeds derived from it and their key, pinned by load tests
+        self.seed = None
+
+    ########################
+    ### Command Handling ###
+    ########################
+
+    async def execute(self, room_key, mutate, effect=None, create=False, check=False, touch=True):
+        """Queue command to the actor of room and wait for its result
+
+        Arguments:
+            room_key {str} -- room key
+            mutate {callable} -- called with room, must change nothing but the room,
+                returns `Unchanged` when it changed nothing
+
+        Keyword Arguments:
+            effect {coroutine function} -- called with room and result of mutate after save (default: {None})
+            create {bool} -- create room when it does not exist (default: {False})
+            check {bool} -- check phase completion after the command (default: {False})
+            touch {bool} -- command of users, which keeps room from room sweeper (default: {True})
+
+        Raises:
+            KeyError -- room does not exist
+        """
+        return await self.submit(room_key, Command(mutate, effect, create, check, touch))
+
+    async def submit(self, room_key, command):
+        if self.sweeper is not None:
+            self.sweeper.start()
+        actor = self.actors.get(room_key)
+        if actor is None:
+            actor = RoomActor(room_key, self.apply, self.actor_idle)
+            self.actors[room_key] = actor
+        return await actor.submit(command)
+
+    def actor_idle(self, actor):
+        if self.actors.get(actor.room_key) is actor:
+            del self.actors[actor.room_key]
+
+    async def apply(self, room_key, batch):
+        """Apply batch of commands with single load and save, then run their effects in order
+        """
+        failed = {}
+
+        def mutate(room):
+            room.journal = [] if self.game_log is not None else None
+            if room.version == 0:
+                # not saved yet, no game has started
+                if self.seed is not None:
+                    room.status.seed = random.Random('{}:{}'.format(self.seed, room_key)).getrandbits(32)
+                # log of a reused key starts over
+                room.record('create', room.status.seed)
+            results = []
+            changed = False
+            for command in batch:
+                if command in failed:
+                    results.append((None, failed[command]))
+                    continue
+                try:
+                    result = command.mutate(room)
+                except Exception as e:
+                    # the room may be changed halfway, it is not saved
+                    failed[command] = e
+                    raise CommandFailed() from e
+                if isinstance(result, Unchanged):
+                    result = result.result
+                else:
+                    changed = True
+                results.append((result, None))
+            if any(command.touch and command not in failed for command in batch):
+                room.touched_at = time.time()
+                changed = True
+            # nothing to save, e.g. phase check which did not proceed
+            return results if changed else Unchanged(results)
+
+        while True:
+            try:
+                room, results = await self.store.update(room_key, mutate, any(command.create for command in batch))
+                break
+            except CommandFailed:
+                continue
+            except (KeyError, RoomConflictError) as e:
+                for command in batch:
+                    command.resolve(error=e)
+                return
+        self.lobby.track(room)
+        if room.journal:
+            self.game_log.append(room_key, room.journal)
+            room.journal = None
+        for command, (result, error) in zip(batch, results):
+            if error is None and command.effect is not None:
+                try:
+                    result = await command.effect(room, result)
+                except Exception as e:
+                    error = e
+            command.resolve(result, error)
+        if any(command.check for command in batch):
+            # already in the actor, do not queue it
+            command = self.check_command(room.phase_seq)
+            await self.apply(room_key, [command])
+            if command.future.exception() is not None:
+                logger.error('Failed to check phase of room {}: {!r}'.format(room_key, command.future.exception()))
+
+    #####################
+    ### Room Commands ###
+    #####################
+
+    async def delete_room(self, room_key):
+        await self.store.delete(room_key)
+        self.lobby.track_removed(room_key)
+        self.event_logs.pop(room_key, None)
+        timer = self.timers.pop(room_key, None)
+        if timer is not None:
+            self.timer.cancel(timer)
+
+    async def evict(self, room_key, expired):
+        """Delete room and send its users back to main group
+
+        Arguments:
+            room_key {str} -- room key
+            expired {callable} -- called with room in its actor, evicted unless it returns None
+
+        Returns:
+            str -- result of expired, None when room is kept
+        """
+        def check(room):
+            state = expired(room)
+            return state, room.team_groups() if state is not None else None
+
+        async def close(room, checked):
+            state, teams = checked
+            if state is not None:
+                logger.info('room {} is evicted, {}'.format(room_key, state))
+                await self.delete_room(room_key)
+                await self.leave_teams(teams)
+                await get_channel_layer().group_send(room_key, {
+                    'type': HandlerType.ROOM_CLOSED,
+                    'room': room_key,
+                })
+            return state
 
-    def get_user(self, room_key, user_key):
         try:
-            return self.room_map[room_key].get_user(user_key)
+            return await self.execute(room_key, check, close, touch=False)
         except KeyError:
             return None
 
-    def get_type(self, room_key):
-        try:
-            return self.room_map[room_key].get_type()
-        except KeyError:
+    async def room_exists(self, room_key):
+        return await self.store.exists(room_key)
+
+    async def get_user(self, room_key, user_key):
+        room = await self.store.load(room_key)
+        if room is None:
+            return None
+        return room.get_user(user_key)
+
+    async def get_type(self, room_key):
+        room = await self.store.load(room_key)
+        if room is None:
             return None
+        return room.get_type()
+
+    async def get_event_seq(self, room_key):
+        room = await self.store.load(room_key)
+        if room is None:
+            return None
+        return room.event_seq
+
+    async def missed_events(self, room_key, user_key, event_seq):
+        """Events of room sent to user after `event_seq`
+
+        Returns:
+            list -- messages in order, None when client needs full room information
+        """
+        room = await self.store.load(room_key)
+        log = self.event_logs.get(room_key)
+        if room is None or log is None or log.last_seq != room.event_seq:
+            # events may be applied by other workers, or not published yet
+            return None
+        return log.since(event_seq, user_key)
 
     async def add_user(self, room_key, channel):
-        try:
-            # room exists
-            logger.debug('user {} is added to room {}'.format(channel.username, room_key))
-            self.room_map[room_key].add_user(channel.user_key, channel.username, channel.channel_name)
-            await self.alert_member_changed(room_key, channel.user_key, channel.username)
-        except KeyError:
-            # create new room
-            logger.debug('new room {} is created'.format(room_key))
-            new_room = Room(room_key)
-            new_room.add_user(channel.user_key, channel.username, channel.channel_name)
-            self.room_map[room_key] = new_room
+        """Add user to room, creating the room when it does not exist
+
+        Returns:
+            str -- name of the user in room, a new one when the name is taken in room
+        """
+        def add(room):
+            created = room.version == 0 and not room.get_user_list()
+            username = channel.username
+            taken = set(user.name for user in room.get_user_list())
+            if username in taken:
+                username = name_generator.get_name(taken)
+            room.add_user(channel.user_key, username, channel.channel_name)
+            if created:
+                return created, username, None
+            return created, username, self.member_changed(room, channel.user_key, username)
+
+        async def alert(room, added):
+            created, username, message = added
+            logger.debug('user {} is added to room {}'.format(username, room_key))
+            if not created:
+                await self.publish(room, message)
+            return username
+
+        return await self.execute(room_key, add, alert, create=True)
 
     async def remove_user(self, room_key, channel):
-        try:
-            self.room_map[room_key].cur_phase.remove_user(channel.user_key)
-            if len([user for user in self.room_map[room_key].get_user_list() if user.connected]) < 1:
+        def remove(room):
+            room.remove_user(channel.user_key)
+            return self.member_changed(room, channel.user_key, channel.username)
+
+        async def alert(room, message):
+            # users stay in the room during a game, only their channel leaves
+            removed = room.get_user(channel.user_key)
+            group = room.team_group(removed) if removed else None
+            if group is not None:
+                await get_channel_layer().group_discard(group, channel.channel_name)
+            if not any(user.connected for user in room.get_user_list()):
                 # remove empty room
-                del self.room_map[room_key]
+                await self.delete_room(room_key)
             else:
-                await self.alert_member_changed(room_key, channel.user_key, channel.username)
+                await self.publish(room, message)
+
+        try:
+            await self.execute(room_key, remove, alert)
         except KeyError:
             logger.error('Attempt to remove user from unregistered room!')
 
     async def reconnect_user(self, room_key, channel):
+        def reconnect(room):
+            room.reconnect_user(channel.user_key, channel.channel_name)
+            return self.member_changed(room, channel.user_key, channel.username)
+
+        async def alert(room, message):
+            user = room.get_user(channel.user_key)
+            group = room.team_group(user) if user else None
+            if group is not None:
+                await get_channel_layer().group_add(group, channel.channel_name)
+            await self.publish(room, message)
+
         try:
             # room exists
             logger.debug('user {} is reconnected to room {}'.format(channel.user_key, room_key))
-            self.room_map[room_key].reconnect_user(channel.user_key, channel.channel_name)
-            await self.alert_member_changed(room_key, channel.user_key, channel.username)
+            await self.execute(room_key, reconnect, alert)
         except KeyError:
             logger.error('Attempt to reconnected user from unregistered room!')
 
-    def disconnect_user(self, room_key, user_key):
+    async def disconnect_user(self, room_key, user_key):
+        async def remove_empty(room, _):
+            if not any(user.connected for user in room.get_user_list()):
+                await self.delete_room(room_key)
+
         try:
             # room exists
-            self.room_map[room_key].disconnect_user(user_key)
-            if len(self.room_map[room_key].users) < 1:
-                del self.room_map[room_key]
+            await self.execute(room_key, lambda room: room.disconnect_user(user_key), remove_empty)
         except KeyError:
             logger.error('Attempt to disconnect user from unregistered room!')
 
     async def choose(self, room_key, user_key, target_key, status):
-        try:
-            # room exsits
-            cur_room = self.room_map[room_key]
-            if cur_room.choose(user_key, target_key, Choice.Status(status)):
-                event = {
-                    'type': HandlerType.CHOOSE_CHANGED,
-                    'user': user_key,
-                    'choice': {
-                        'target': target_key,
-                        'status': status
-                    }
+        def choose(room):
+            if not room.choose(user_key, target_key, Choice.Status(status)):
+                return None, room.get_type()
+            return self.stamp(room, {
+                'type': HandlerType.CHOOSE_CHANGED,
+                'user': user_key,
+                'choice': {
+                    'target': target_key,
+                    'status': status
                 }
-                if cur_room.get_type() == 3:
+            }), room.get_type()
+
+        async def alert(cur_room, chosen):
+            event, room_type = chosen
+            if event is not None:
+                if room_type == 3:
                     # when night
-                    await self.alert_on_jobs(room_key, user_key, event)
+                    await self.alert_on_jobs(cur_room, user_key, event)
                 else:
-                    await get_channel_layer().group_send(room_key, event)
+                    await self.publish(cur_room, event)
             else:
                 # can not choose
-                user = self.get_user(room_key, user_key)
+                user = cur_room.get_user(user_key)
                 await get_channel_layer().send(
                     user.channel_name,
                     {
@@ -149,6 +331,11 @@ class RoomHandler:
                         'target': target_key,
                     }
                 )
+
+        try:
+            # room exsits
+            # phase completion is checked once per batch, not in every member's consumer
+            await self.execute(room_key, choose, alert, check=True)
         except KeyError:
             logger.error('Attempt to toggle ready from unregistered room!')
             return None
@@ -156,127 +343,269 @@ class RoomHandler:
             logger.error('Choice with invalid status')
             return None
 
-    async def check_done(self, room_key):
+    async def check_done(self, room_key, phase_seq=None):
+        """Move room to next phase when current phase is done and alert results
+
+        Arguments:
+            room_key {str} -- room key
+
+        Keyword Arguments:
+            phase_seq {int} -- phase observed by caller, skip when room already moved (default: {None})
+        """
         logger.debug('check_done')
         try:
             # room exists
-            cur_room = self.room_map[room_key]
-            if cur_room.done():
-                prev_status = cur_room.get_type()
-                result = cur_room.result()
-                cur_room.next_phase()
-                for user in self.room_user_list(room_key):
-                    if user.connected:
-                        processed = self.process_result(room_key, user, prev_status, result)
-                        await get_channel_layer().send(
-                            user.channel_name,
-                            {
-                                'type': HandlerType.COMMON_SEND,
-                                'ret_type': HandlerType.ROOM_STATUS_CHANGED,
-                                'prev_status': prev_status,
-                                'result': processed,
-                                'status': cur_room.get_type(),
-                            }
-                        )
-                await self.alert_member_changed(room_key, user.key, user.name)
-                done = cur_room.game_done()
-                if done is not None:
-                    await get_channel_layer().group_send(
-                        room_key,
-                        {
-                            'type': HandlerType.COMMON_SEND,
-                            'ret_type': HandlerType.GAME_DONE,
-                            'result': done.dict()
-                        }
-                    )
+            await self.submit(room_key, self.check_command(phase_seq))
         except KeyError:
             logger.error('Attempt to toggle ready from unregistered room!')
             return None
 
-    def get_team_mates(self, room_key, user_key):
-        user = self.get_user(room_key, user_key)
-        if user.job.visible_team():
-            return [row.dict() for row in self.room_user_list(room_key) if type(row.job) == type(user.job)]
-        else:
-            return [user.dict()]
-
-    def get_targets(self, room_key, user_key):
-        cur_room = self.room_map[room_key]
-        return [target_user.dict() for target_user in self.room_user_list(room_key) 
-                    if cur_room.can_target(self.get_user(room_key, user_key), target_user)]
-
-    def process_result(self, room, user, status, result):
-        cur_room = self.room_map[room]
-        processed = {}
-        if status == 0:
-            # after job initiated
-            if user.job.visible_team():
-                team_mates = [row.dict() for row in result if type(row.job) == type(user.job)]
-            else:
-                team_mates = [user.dict()]
-            processed['team_mates'] = team_mates
-            processed['job'] = user.job.name()
-        if status == 2:
-            # after day vote result
-            if result:
-                processed['victim'] = result.dict()
-        if status == 3:
-            # after night action result
-            act_list = []
-            for row in result:
-                if row.scope == 'all' or row.scope == user.job.name():
-                    act_list.append(row.dict())
-            processed['act_list'] = act_list
-        if cur_room.get_type() == 3:
-            # before night
-            processed['targets'] = [target_user.dict() for target_user in self.room_user_list(room)
-                                    if cur_room.can_target(user, target_user)]
-        return processed
-
-    def add_job(self, room, job):
+    def check_command(self, phase_seq=None):
+        def proceed(cur_room):
+            proceeded = cur_room.proceed(phase_seq)
+            if proceeded is None:
+                return Unchanged()
+            prev_status, result = proceeded
+            messages = self.process_results(cur_room, prev_status, result)
+            # single event, with different content for each user
+            event_seq = cur_room.next_event_seq()
+            for _, message in messages:
+                message['event_seq'] = event_seq
+            # most members change with the phase
+            member = self.member_refreshed(cur_room)
+            # team roster is gone once the game is done
+            teams = cur_room.team_groups()
+            done = cur_room.game_done()
+            if done is not None:
+                done = self.stamp(cur_room, {
+                    'type': HandlerType.COMMON_SEND,
+                    'ret_type': HandlerType.GAME_DONE,
+                    'result': done.dict()
+                })
+            return prev_status, messages, member, teams, done
+
+        async def alert(cur_room, proceeded):
+            if proceeded is None:
+                return None
+            prev_status, messages, member, teams, done = proceeded
+            if prev_status == 0:
+                # jobs are assigned
+                await self.join_teams(teams)
+            # users sharing a message get the same encoded frame
+            variants = {}
+            for user, message in messages:
+                variants.setdefault(id(message), (message, []))[1].append(user)
+            # every user waits for the phase change, do not make the last one wait for the others
+            await asyncio.gather(*[self.publish(cur_room, message, users, variant=True)
+                                   for message, users in variants.values()])
+            await self.publish(cur_room, member)
+            if done is not None:
+                await self.publish(cur_room, done)
+                await self.leave_teams(teams)
+                self.archive_games(cur_room)
+            self.start_deadline(cur_room)
+
+        # not a command of users, the command checked after already touched the room
+        return Command(proceed, alert, touch=False)
+
+    def archive_games(self, cur_room):
+        for game in cur_room.history.drain():
+            if self.archive is not None:
+                try:
+                    self.archive(cur_room.room_key, game)
+                except Exception:
+                    logger.exception('Failed to archive game of room {}'.format(cur_room.room_key))
+
+    def start_deadline(self, cur_room):
+        """Schedule deadline of current phase, replacing the one of previous phase
+        """
+        timer = self.timers.pop(cur_room.room_key, None)
+        if timer is not None:
+            self.timer.cancel(timer)
+        delay = self.deadlines.get(cur_room.get_type())
+        if delay is not None:
+            self.timers[cur_room.room_key] = self.timer.schedule(
+                delay, self.expire, cur_room.room_key, cur_room.phase_seq)
+
+    async def expire(self, room_key, phase_seq):
+        """Apply default choices of a phase which passed its deadline, then proceed
+        """
+        logger.debug('deadline of room {} passed'.format(room_key))
         try:
-            self.room_map[room].add_job(job)
+            # not a command of users, rooms of idle users still expire
+            await self.execute(room_key, lambda cur_room: cur_room.expire(phase_seq), check=True, touch=False)
         except KeyError:
-            logger.error('Attempt to add job to unregistered room!')
+            logger.debug('room {} is deleted before its deadline'.format(room_key))
+
+    async def get_team_mates(self, room_key, user_key):
+        cur_room = await self.store.load(room_key)
+        user = cur_room.get_user(user_key)
+        return [row.dict() for row in cur_room.status.team(user)]
+
+    async def get_targets(self, room_key, user_key):
+        cur_room = await self.store.load(room_key)
+        user = cur_room.get_user(user_key)
+        return [target_user.dict() for target_user in cur_room.get_user_list()
+                    if cur_room.can_target(user, target_user)]
+
+    def process_results(self, cur_room, status, result):
+        """Build ROOM_STATUS_CHANGED messages of connected users after a phase change
+
+        Parts depending only on job (team mates, act list, night targets) are
+        built once per job, not once per user. Users with the same content
+        share the message object.
+
+        Arguments:
+            cur_room {Room} -- room after the phase change
+            status {int} -- type of previous phase
+            result -- result of previous phase
+
+        Returns:
+            list -- (user, message) of each connected user
+        """
+        cur_type = cur_room.get_type()
+        shared = {}
+
+        def share(key, build):
+            if key not in shared:
+                shared[key] = build()
+            return shared[key]
+
+        messages = []
+        variants = {}
+        for user in cur_room.get_user_list():
+            if not user.connected:
+                continue
+            job_name = user.job.name() if user.job else None
+            # content depends on job and whether user can act, and on user itself for hidden teams
+            variant = (job_name, user.can_act(),
+                       user.key if status == 0 and not user.job.visible_team() else None)
+            if variant in variants:
+                messages.append((user, variants[variant]))
+                continue
+            processed = {}
+            if status == 0:
+                # after job initiated
+                if user.job.visible_team():
+                    processed['team_mates'] = share(('team_mates', job_name), lambda: [
+                        row.dict() for row in cur_room.status.team(user)])
+                else:
+                    processed['team_mates'] = [user.dict()]
+                processed['job'] = job_name
+            if status == 2:
+                # after day vote result
+                if result:
+                    processed['victim'] = share('victim', result.dict)
+            if status == 3:
+                # after night action result
+                processed['act_list'] = share(('act_list', job_name), lambda: [
+                    row.dict() for row in result if row.scope == 'all' or row.scope == job_name])
+            if cur_type == 3:
+                # before night, targets depend on job and whether the user can act
+                processed['targets'] = share(('targets', job_name, user.can_act()), lambda: [
+                    target_user.dict() for target_user in cur_room.get_user_list()
+                    if cur_room.can_target(user, target_user)])
+            variants[variant] = {
+                'type': HandlerType.COMMON_SEND,
+                'ret_type': HandlerType.ROOM_STATUS_CHANGED,
+                'prev_status': status,
+                'result': processed,
+                'status': cur_type,
+            }
+            messages.append((user, variants[variant]))
+        return messages
+
+    async def add_job(self, room, job):
+        def add(cur_room):
+            cur_room.add_job(job)
+            return self.job_changed(cur_room)
 
-    def remove_job(self, room, job):
         try:
-            self.room_map[room].remove_job(job)
+            await self.execute(room, add, self.publish)
         except KeyError:
-            logger.error('Attempt to remove job to unregistered room!')
+            logger.error('Attempt to add job to unregistered room!')
 
-    def room_list(self):
-        rooms = []
-        for room_key in self.room_map:
-            room = self.room_map[room_key]
-            if room.type() == WaitingRoom:
-                rooms.append({
-                    'name': room_key,
-                    'num': len(room.get_user_list())
-                })
-        return rooms
+    async def remove_job(self, room, job):
+        def remove(cur_room):
+            cur_room.remove_job(job)
+            return self.job_changed(cur_room)
 
-    def room_user_list(self, room):
         try:
-            return self.room_map[room].get_user_list()
+            await self.execute(room, remove, self.publish)
         except KeyError:
+            logger.error('Attempt to remove job to unregistered room!')
+
+    async def lobby_snapshot(self):
+        """Full list of waiting rooms, changes after it are sent by the lobby index
+        """
+        return await self.lobby.snapshot()
+
+    async def room_user_list(self, room):
+        cur_room = await self.store.load(room)
+        if cur_room is None:
             logger.error('Attempt to access unregistered room!')
+            return None
+        return cur_room.get_user_list()
 
-    def room_job_list(self, room):
-        try:
-            return self.room_map[room].get_job_list()
-        except KeyError:
+    async def room_job_list(self, room):
+        cur_room = await self.store.load(room)
+        if cur_room is None:
             logger.error('Attempt to access unregistered room!')
+            return None
+        return cur_room.get_job_list()
 
-    def room_choice_list(self, room):
-        try:
-            return [choice.user_dict() for choice in self.room_map[room].get_choice_list()]
-        except KeyError:
+    async def job_balance(self, room, games=100000):
+        """Win probabilities of the job composition of a waiting room
+
+        Games are played by `BalanceAnalyzer` in the default executor, reports
+        are kept by composition.
+
+        Returns:
+            dict -- win probability by group, None when room is not waiting or has no jobs the analyzer plays
+        """
+        cur_room = await self.store.load(room)
+        if cur_room is None or cur_room.type() != WaitingRoom:
+            return None
+        jobs = {row['job']: row['count'] for row in cur_room.get_job_list() if row['count'] > 0}
+        if not jobs:
+            return None
+        key = tuple(sorted(jobs.items()))
+        if key not in self.balances:
+            from game.core.balance import BalanceAnalyzer
+            try:
+                analyzer = BalanceAnalyzer(sum(jobs.values()), jobs, games=games)
+            except ValueError:
+                return None
+            report = await asyncio.get_event_loop().run_in_executor(None, analyzer.run)
+            while len(self.balances) >= 256:
+                del self.balances[next(iter(self.balances))]
+            self.balances[key] = report['wins']
+        return self.balances[key]
+
+    async def room_choice_list(self, room):
+        cur_room = await self.store.load(room)
+        if cur_room is None:
             logger.error('Attempt to access unregistered room!')
+            return None
+        return self.choice_list(cur_room)
+
+    def choice_list(self, cur_room):
+        return [choice.user_dict() for choice in cur_room.get_choice_list()]
+
+    async def game_done(self, room):
+        def done(cur_room):
+            teams = cur_room.team_groups()
+            return teams, cur_room.game_done()
+
+        async def leave(cur_room, result):
+            teams, done = result
+            if done is not None:
+                await self.leave_teams(teams)
+                self.archive_games(cur_room)
+            return done
 
-    def game_done(self, room):
         try:
-            return self.room_map[room].game_done()
+            return await self.execute(room, done, leave)
         except KeyError:
             logger.error('Attempt to access unregistered room!')
 
@@ -284,24 +613,84 @@ class RoomHandler:
     ### Sender Methods ###
     ######################
 
-    async def alert_member_changed(self, room_key, user_key, username):
-        await get_channel_layer().group_send(
-            room_key,
-            {
-                'type': HandlerType.COMMON_SEND,
-                'ret_type': HandlerType.ROOM_MEMBER_CHANGED,
-                'id': user_key,
-                'name': username,
-                'users': [choice for choice in self.room_choice_list(room_key)]
-            }
-        )
-
-    async def alert_on_jobs(self, room_key, user_key, message):
-        user_list = self.room_user_list(room_key)
-        chooser = self.get_user(room_key, user_key)
-        if chooser.job.visible_team():
-            team_mates = [user for user in user_list if type(user.job) == type(chooser.job)]
+    def stamp(self, cur_room, message):
+        """Number message as the next event of room, call it while mutating the room
+        """
+        message['event_seq'] = cur_room.next_event_seq()
+        return message
+
+    def member_changed(self, cur_room, user_key, username):
+        """Entry of single user, removed when user is not in room anymore
+        """
+        choice = cur_room.status.get_choice(user_key)
+        return self.stamp(cur_room, {
+            'type': HandlerType.COMMON_SEND,
+            'ret_type': HandlerType.ROOM_MEMBER_CHANGED,
+            'id': user_key,
+            'name': username,
+            'changed': [choice.user_dict()] if choice is not None else [],
+            'removed': [] if choice is not None else [user_key],
+        })
+
+    def member_refreshed(self, cur_room):
+        """Entries of every user, replacing what client has
+        """
+        return self.stamp(cur_room, {
+            'type': HandlerType.COMMON_SEND,
+            'ret_type': HandlerType.ROOM_MEMBER_REFRESHED,
+            # unchanged users are not encoded again
+            'users': Encoded.join(choice.user_json() for choice in cur_room.get_choice_list())
+        })
+
+    def job_changed(self, cur_room):
+        return self.stamp(cur_room, {
+            'type': HandlerType.COMMON_SEND,
+            'ret_type': HandlerType.JOB_CHANGED,
+            'jobs': cur_room.get_job_list(),
+        })
+
+    async def publish(self, cur_room, message, users=None, group=None, variant=False):
+        """Keep stamped event in the event log of room and send it
+
+        Arguments:
+            cur_room {Room} -- saved room
+            message {dict} -- message stamped while mutating the room
+
+        Keyword Arguments:
+            users {list} -- receiving users, everyone in room when None (default: {None})
+            group {str} -- channel group of the receiving users (default: {None})
+            variant {bool} -- one content of an event meant for every user in room (default: {False})
+        """
+        # encoded once here, consumers forward the text
+        event = frame(message)
+        log = self.event_logs.get(cur_room.room_key)
+        if log is None:
+            log = self.event_logs[cur_room.room_key] = EventLog()
+        log.record(message['event_seq'], event['text'],
+                   None if users is None else set(user.key for user in users), variant)
+        layer = get_channel_layer()
+        if users is None:
+            await layer.group_send(cur_room.room_key, event)
+        elif group is not None:
+            await layer.group_send(group, event)
         else:
-            team_mates = [chooser]
-        for mate in team_mates:
-            await get_channel_layer().send(mate.channel_name, message)
+            await asyncio.gather(*[layer.send(user.channel_name, event) for user in users])
+
+    async def alert_on_jobs(self, cur_room, user_key, message):
+        chooser = cur_room.get_user(user_key)
+        await self.publish(cur_room, message, cur_room.status.team(chooser), cur_room.team_group(chooser))
+
+    async def join_teams(self, teams):
+        """Add channels to team groups
+
+        Arguments:
+            teams {dict} -- channel names by group, from `Room.team_groups`
+        """
+        layer = get_channel_layer()
+        await asyncio.gather(*[layer.group_add(group, channel_name)
+                               for group, channel_names in teams.items() for channel_name in channel_names])
+
+    async def leave_teams(self, teams):
+        layer = get_channel_layer()
+        await asyncio.gather(*[layer.group_discard(group, channel_name)
+                               for group, channel_names in teams.items() for channel_name in channel_names])
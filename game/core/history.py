@@ -0,0 +1,112 @@
+import json
+import logging
+import time
+from collections import deque
+from game.core.conf import setting
+
+logger = logging.getLogger('mafia')
+
+
+class GameHistory:
+    """Phase records of the current game and of a few finished games
+
+    Each phase is kept as a small dict instead of its processor:
+        {'type': room type, 'order': day count, 'started_at': time, 'ended_at': time, 'result': summary}
+
+    Finished games beyond `games` are rotated out to `rotated`, for the room
+    handler to hand them to an archive sink after the room is saved.
+
+    Keyword Arguments:
+        games {int} -- finished games kept in the room (default: {3})
+        phases {int} -- phases kept per game, the earliest ones are dropped (default: {100})
+    """
+
+    def __init__(self, games=3, phases=100):
+        self.current = deque(maxlen=phases)
+        self.games = deque()
+        self.max_games = games
+        self.max_phases = phases
+        self.started_at = time.time()
+        # rotated out since loaded, not saved with the room
+        self.rotated = []
+
+    def open(self, phase_type, order):
+        self.current.append({
+            'type': phase_type,
+            'order': order,
+            'started_at': time.time(),
+            'ended_at': None,
+            'result': None,
+        })
+
+    def close(self, result=None):
+        if self.current and self.current[-1]['ended_at'] is None:
+            self.current[-1]['ended_at'] = time.time()
+            self.current[-1]['result'] = result
+
+    def finish(self, winner, seed=None):
+        """Move current game to finished games
+
+        Arguments:
+            winner {str} -- name of winning group
+
+        Keyword Arguments:
+            seed {int} -- seed jobs of the game were shuffled with (default: {None})
+        """
+        self.close()
+        self.games.append({
+            'winner': winner,
+            'seed': seed,
+            'started_at': self.started_at,
+            'ended_at': time.time(),
+            'phases': list(self.current),
+        })
+        self.current.clear()
+        self.started_at = time.time()
+        while len(self.games) > self.max_games:
+            self.rotated.append(self.games.popleft())
+
+    def drain(self):
+        """Games rotated out since the last drain
+        """
+        rotated, self.rotated = self.rotated, []
+        return rotated
+
+    def dump(self):
+        return {
+            'current': list(self.current),
+            'games': list(self.games),
+            'started_at': self.started_at,
+            'max_games': self.max_games,
+            'max_phases': self.max_phases,
+        }
+
+    @classmethod
+    def load(cls, data):
+        history = cls(data['max_games'], data['max_phases'])
+        history.current.extend(data['current'])
+        history.games.extend(data['games'])
+        history.started_at = data['started_at']
+        return history
+
+
+def log_archive(room_key, game):
+    """Archive sink writing finished games to the log as json lines
+    """
+    logger.info('archive {} {}'.format(room_key, json.dumps(game)))
+
+
+def get_game_archive():
+    """Archive sink configured by `MAFIA_GAME_ARCHIVE` setting
+
+    Sink is a dotted path of a callable taking room key and finished game.
+
+    Example:
+        MAFIA_GAME_ARCHIVE = 'game.core.history.log_archive'
+
+    Returns:
+        callable -- None when rotated games are dropped
+    """
+    from django.utils.module_loading import import_string
+    path = setting('MAFIA_GAME_ARCHIVE')
+    return import_string(path) if path is not None else None
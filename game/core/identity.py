@@ -0,0 +1,135 @@
+import json
+import time
+import uuid
+from collections import OrderedDict
+from game.core.conf import setting
+
+# signed cookie holding user key, set by index view and read on websocket connect
+IDENTITY_COOKIE = 'mafia_user'
+IDENTITY_SALT = 'mafia.identity'
+IDENTITY_MAX_AGE = 60 * 60 * 24 * 30
+
+
+def new_user_key():
+    return 'user_{}'.format(uuid.uuid4())
+
+
+def read_user_key(cookies):
+    """Unsign user key of identity cookie
+
+    Arguments:
+        cookies {dict} -- cookies of request or websocket scope
+
+    Returns:
+        str -- user key, None when cookie is missing or tampered
+    """
+    from django.core import signing
+    value = cookies.get(IDENTITY_COOKIE)
+    if value is None:
+        return None
+    try:
+        # same as HttpRequest.get_signed_cookie
+        return signing.get_cookie_signer(salt=IDENTITY_COOKIE + IDENTITY_SALT).unsign(
+            value, max_age=IDENTITY_MAX_AGE)
+    except signing.BadSignature:
+        return None
+
+
+class IdentityStore:
+    """Base class for rejoin state of users, by user key
+
+    Identity is a dict of `username` and `room_key`, saved on disconnect and
+    loaded on connect instead of django sessions, so sockets never touch the
+    database.
+
+    Keyword Arguments:
+        ttl {int} -- seconds an identity is kept after its last save (default: {one day})
+    """
+
+    def __init__(self, ttl=60 * 60 * 24):
+        self.ttl = ttl
+
+    async def load(self, user_key):
+        """Load identity
+
+        Returns:
+            dict -- None when unknown or expired
+        """
+        raise NotImplementedError
+
+    async def save(self, user_key, identity):
+        raise NotImplementedError
+
+
+class MemoryIdentityStore(IdentityStore):
+    """Keep identities in process memory
+
+    Identities are lost on restart, use `RedisIdentityStore` to keep them.
+    """
+
+    def __init__(self, ttl=60 * 60 * 24):
+        super().__init__(ttl)
+        # saved order is expiry order, as every identity has the same ttl
+        self.identities = OrderedDict()
+
+    async def load(self, user_key):
+        saved = self.identities.get(user_key)
+        if saved is None or saved[0] < time.monotonic():
+            return None
+        return dict(saved[1])
+
+    async def save(self, user_key, identity):
+        now = time.monotonic()
+        self.identities[user_key] = (now + self.ttl, dict(identity))
+        self.identities.move_to_end(user_key)
+        while self.identities:
+            expires, _ = next(iter(self.identities.values()))
+            if expires >= now:
+                break
+            self.identities.popitem(last=False)
+
+
+class RedisIdentityStore(IdentityStore):
+    """Keep identities in redis with expiry, shared by workers and kept on restart
+    """
+
+    def __init__(self, host='redis://localhost:6379', prefix='mafia:', ttl=60 * 60 * 24):
+        super().__init__(ttl)
+        self.host = host
+        self.prefix = prefix
+        self.pool = None
+
+    async def connection(self):
+        if self.pool is None:
+            import aioredis
+            self.pool = await aioredis.create_redis_pool(self.host)
+        return self.pool
+
+    def identity_key(self, user_key):
+        return '{}identity:{}'.format(self.prefix, user_key)
+
+    async def load(self, user_key):
+        redis = await self.connection()
+        saved = await redis.get(self.identity_key(user_key), encoding='utf-8')
+        if saved is None:
+            return None
+        return json.loads(saved)
+
+    async def save(self, user_key, identity):
+        redis = await self.connection()
+        await redis.set(self.identity_key(user_key), json.dumps(identity), expire=self.ttl)
+
+
+def get_identity_store():
+    """Build identity store configured by `MAFIA_IDENTITY_STORE` setting
+
+    Example:
+        MAFIA_IDENTITY_STORE = {
+            'BACKEND': 'game.core.identity.RedisIdentityStore',
+            'CONFIG': {'host': 'redis://localhost:6379'},
+        }
+    """
+    from django.utils.module_loading import import_string
+    config = setting('MAFIA_IDENTITY_STORE', {})
+    backend = import_string(config.get('BACKEND', 'game.core.identity.MemoryIdentityStore'))
+    return backend(**config.get('CONFIG', {}))
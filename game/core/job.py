@@ -1,4 +1,3 @@
-from enum import Enum
 from game.core.base import User
 
 ###################
@@ -7,13 +6,26 @@ from game.core.base import User
 
 
 class Group:
-    pass
+    """Side of jobs, winning together
+
+    Room status keeps the number of users who can act by group, so `do_win`
+    decides from `status.group_count(group)` and `status.active_count` without
+    scanning users.
+    """
+
+    @classmethod
+    def do_win(cls, status):
+        raise NotImplementedError
+
+    @classmethod
+    def dict(cls):
+        return cls.__name__.lower()
 
 
 class CitizenGroup(Group):
     @classmethod
     def do_win(cls, status):
-        return all(user.job.group == cls for user in status.users if user.can_act())
+        return status.group_count(cls) == status.active_count
 
     @classmethod
     def dict(cls):
@@ -23,8 +35,7 @@ class CitizenGroup(Group):
 class MafiaGroup(Group):
     @classmethod
     def do_win(cls, status):
-        return len([user for user in status.users if user.can_act() and user.job.group == cls]) \
-               >= len([user for user in status.users if user.can_act()]) / 2
+        return status.group_count(cls) >= status.active_count / 2
 
     @classmethod
     def dict(cls):
@@ -34,16 +45,40 @@ class MafiaGroup(Group):
 ### Game Jobs ###
 #################
 
+# job classes by job name, in order of registration
+JOBS = {}
+
+
+def register_job(job_class):
+    """Class decorator making a job available to rooms by its name
+
+    Example:
+        @register_job
+        class CustomJob(Job):
+            ...
+    """
+    JOBS[job_class.name()] = job_class
+    return job_class
+
+
+def get_job(job_name):
+    """Registered job class of given name, None when there is no such job
+    """
+    return JOBS.get(job_name.lower())
+
 
 class Job:
     """Base abstract class for all jobs
+
+    Jobs keep no state, so an instance is shared by every user of the job in a room.
     
     Attributes:
         order {int} -- order of job execution (job action with less order will be excuted early)
     """
 
-    def __init__(self):
-        self.order = 100
+    __slots__ = ()
+    order = 100
+    group = None
 
     def can_act(self, room_status):
         return False
@@ -54,8 +89,9 @@ class Job:
     def act(self, target):
         return None
 
-    def name(self):
-        return self.__class__.__name__.lower()
+    @classmethod
+    def name(cls):
+        return cls.__name__.lower()
 
     def visible_team(self):
         """Can this job members recongnize each other
@@ -63,21 +99,21 @@ class Job:
         return True
 
 
+@register_job
 class Citizen(Job):
 
-    def __init__(self):
-        super().__init__()
-        self.group = CitizenGroup
+    __slots__ = ()
+    group = CitizenGroup
 
     def visible_team(self):
         return False
 
 
+@register_job
 class Police(Citizen):
 
-    def __init__(self):
-        super().__init__()
-        self.order = 50
+    __slots__ = ()
+    order = 50
 
     def can_act(self, room_status):
         return True
@@ -96,12 +132,12 @@ class Police(Citizen):
         return True
 
 
+@register_job
 class Doctor(Citizen):
 
-    def __init__(self):
-        super().__init__()
-        # it must be ahead of killers
-        self.order = 30
+    __slots__ = ()
+    # it must be ahead of killers
+    order = 30
 
     def can_act(self, room_status):
         return True
@@ -117,12 +153,12 @@ class Doctor(Citizen):
         return True
 
 
+@register_job
 class Mafia(Job):
 
-    def __init__(self):
-        super().__init__()
-        self.group = MafiaGroup
-        self.order = 70
+    __slots__ = ()
+    group = MafiaGroup
+    order = 70
 
     def can_act(self, room_status):
         return True
@@ -140,6 +176,9 @@ class Mafia(Job):
 
 
 class ActResult:
+
+    __slots__ = ('result_type', 'scope', 'result')
+
     def __init__(self, result_type, scope, result):
         """
 
@@ -169,18 +208,35 @@ class ActResult:
                     'confirmation': self.result['confirmation']
                 }
             }
-        return self.__dict__
+        return {name: getattr(self, name) for name in self.__slots__}
 
 
-class JobEnum(Enum):
-    citizen = Citizen
-    doctor = Doctor
-    police = Police
-    mafia = Mafia
+class ActionPlan:
+    """Night actions of the jobs of a room, compiled once when jobs are assigned
 
-    @classmethod
-    def get_by_name(cls, name):
-        try:
-            return cls[name.lower()]
-        except KeyError:
-            return None
+    Arguments:
+        jobs {dict} -- job instances by job name
+
+    Attributes:
+        steps {list} -- (job name, job) in order of execution
+        filters {dict} -- `can_target` of each job by job name
+        groups {list} -- groups of the jobs, in order of checking who wins
+    """
+
+    __slots__ = ('steps', 'filters', 'groups')
+
+    def __init__(self, jobs):
+        self.steps = sorted(jobs.items(), key=lambda step: step[1].order)
+        self.filters = {job_name: job.can_target for job_name, job in jobs.items()}
+        self.groups = []
+        for job in jobs.values():
+            if job.group is not None and job.group not in self.groups:
+                self.groups.append(job.group)
+
+    def acting(self, room_status):
+        """Steps of jobs acting in current night, in order of execution
+        """
+        return [(job_name, job) for job_name, job in self.steps if job.can_act(room_status)]
+
+    def can_target(self, user, target, room_status):
+        return self.filters[user.job.name()](target, room_status)
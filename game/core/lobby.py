@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from channels.layers import get_channel_layer
+from game.core.events import frame
+from game.core.room_processor import WaitingRoom
+from game.socket import HandlerType, MAIN_GROUP
+
+logger = logging.getLogger('mafia')
+
+
+class LobbyIndex:
+    """Waiting rooms shown in main group
+
+    Rooms are tracked whenever they are saved or deleted. Changes are merged
+    within `window` seconds and applied to the lobby kept by the room store,
+    which is shared by workers with a shared store. Deltas it returns are sent
+    to main group, each message with the increasing sequence number of the
+    store. Clients missing a sequence ask for a snapshot.
+
+    Delta format:
+        {'op': 'add' | 'update', 'name': room_key, 'num': user count}
+        {'op': 'remove', 'name': room_key}
+
+    Arguments:
+        handler {RoomHandler} -- handler owning rooms
+
+    Attributes:
+        pending {dict} -- user count by room key to apply, None for rooms not waiting anymore
+        closed {dict} -- phase of rooms tracked out of the lobby, they stay out until their phase changes
+    """
+
+    def __init__(self, handler, group=MAIN_GROUP, window=0.1):
+        self.handler = handler
+        self.group = group
+        self.window = window
+        self.pending = {}
+        self.closed = {}
+        self.flush_handle = None
+
+    def track(self, room):
+        """Track saved room
+        """
+        if room.type() == WaitingRoom:
+            self.closed.pop(room.room_key, None)
+            self.mark(room.room_key, len(room.get_user_list()))
+        elif self.closed.get(room.room_key) != room.phase_seq:
+            # choices during a game do not reach the store
+            self.closed[room.room_key] = room.phase_seq
+            self.mark(room.room_key, None)
+
+    def track_removed(self, room_key):
+        """Track deleted room, listed or not by this worker
+        """
+        self.closed.pop(room_key, None)
+        self.mark(room_key, None)
+
+    def mark(self, room_key, num):
+        self.pending[room_key] = num
+        if self.flush_handle is None:
+            loop = asyncio.get_event_loop()
+            self.flush_handle = loop.call_later(self.window, lambda: asyncio.ensure_future(self.flush()))
+
+    async def flush(self):
+        self.flush_handle = None
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        seq, changes = await self.handler.store.update_lobby(pending)
+        if not changes:
+            return
+        await get_channel_layer().group_send(
+            self.group,
+            frame({
+                'type': HandlerType.COMMON_SEND,
+                'ret_type': HandlerType.MAIN_CHANGED,
+                'seq': seq,
+                'changes': changes,
+            })
+        )
+
+    async def snapshot(self):
+        """Full room list with current sequence number
+        """
+        seq, rooms = await self.handler.store.lobby()
+        return {
+            'seq': seq,
+            'room_list': [{'name': room_key, 'num': num} for room_key, num in rooms.items()],
+        }
@@ -0,0 +1,81 @@
+import random
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+
+class NameGenerator:
+    """Random first names weighted by frequency, loaded once
+
+    Same distribution as `names.get_first_name` (random gender, then by
+    frequency), without reading the name files on every call. Weights are
+    kept as integers, so excluding names is exact.
+
+    Keyword Arguments:
+        files {list} -- name frequency files, first names of `names` package by default
+        rng {random.Random} -- random generator (default: {None})
+    """
+
+    def __init__(self, files=None, rng=None):
+        if files is None:
+            import names
+            files = [names.FILES['first:male'], names.FILES['first:female']]
+        tables = [self.read(filename) for filename in files]
+        totals = [sum(frequencies.values()) for frequencies in tables]
+        scale = 1
+        for total in totals:
+            scale *= total
+        weights = {}
+        for frequencies, total in zip(tables, totals):
+            # every file gets the same share, like picking gender first
+            for name, frequency in frequencies.items():
+                weights[name] = weights.get(name, 0) + frequency * (scale // total)
+        self.names = list(weights)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.weights = array('q', weights.values())
+        self.cumulative = array('q', accumulate(self.weights))
+        self.rng = rng if rng is not None else random.Random()
+
+    @classmethod
+    def read(cls, filename):
+        """Read frequency file of `names` package
+
+        Each line is name, frequency, cumulative frequency and rank.
+
+        Returns:
+            dict -- frequency in thousandths by capitalized name
+        """
+        frequencies = {}
+        with open(filename) as name_file:
+            for line in name_file:
+                row = line.split()
+                if row:
+                    frequencies[row[0].capitalize()] = round(float(row[1]) * 1000)
+        return frequencies
+
+    def get_name(self, taken=()):
+        """Pick a name which is not taken
+
+        Taken names are cut out of the cumulative weights instead of retrying
+        picks, so the cost is a binary search plus a pass over taken names.
+
+        Keyword Arguments:
+            taken {iterable} -- names in use, e.g. names of a room (default: {()})
+
+        Returns:
+            str -- name, None when every name is taken
+        """
+        excluded = sorted(set(self.index[name] for name in taken if name in self.index))
+        remaining = self.cumulative[-1] - sum(self.weights[i] for i in excluded)
+        if remaining <= 0:
+            return None
+        point = self.rng.randrange(remaining)
+        for i in excluded:
+            # skip over the range of excluded name
+            if point < self.cumulative[i] - self.weights[i]:
+                break
+            point += self.weights[i]
+        return self.names[bisect_right(self.cumulative, point)]
+
+
+name_generator = NameGenerator()
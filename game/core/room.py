@@ -0,0 +1,275 @@
+import time
+from game.core.base import *
+from game.core.history import GameHistory
+from game.core.room_status import RoomStatus
+from game.core.room_processor import *
+
+
+class Room:
+
+    DELEGATION_METHOD = [
+        'get_user',
+        'get_user_list',
+        'get_choice_list',
+        'get_job_list',
+        'result',
+        'done',
+        'get_type',
+    ]
+
+    def __init__(self, room_key, users=None, seed=None):
+        self.status = RoomStatus(room_key, users, seed=seed)
+        self.cur_phase = WaitingRoom(self.status)
+        self.history = GameHistory()
+        self.history.open(self.get_type(), self.status.order)
+        # increased on every phase transition, guards duplicated transitions
+        self.phase_seq = 0
+        # bumped by room stores on every successful save
+        self.version = 0
+        # number of the last event sent to users of the room
+        self.event_seq = 0
+        # wall clock of the last command of users, rooms idle for long are swept
+        self.touched_at = time.time()
+        # applied commands for the game log, not saved with the room
+        self.journal = None
+
+    def __getattr__(self, method):
+        if method in Room.DELEGATION_METHOD:
+            return getattr(self.cur_phase, method)
+        raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, method))
+
+    @property
+    def room_key(self):
+        return self.status.room_key
+
+    def team_group(self, user):
+        """Channel group of the team of user
+
+        Returns:
+            str -- group name, None when user's job does not know its team
+        """
+        if user.job is None or not user.job.visible_team():
+            return None
+        return '{}__{}'.format(self.room_key, user.job.name())
+
+    def team_groups(self):
+        """Channel names of each team group, from the roster cached at job assignment
+        """
+        groups = {}
+        for users in self.status.teams.values():
+            group = self.team_group(users[0])
+            if group is not None:
+                groups[group] = [user.channel_name for user in users]
+        return groups
+
+    def next_event_seq(self):
+        """Number a new event, while mutating the room so the number is saved with it
+        """
+        self.event_seq += 1
+        return self.event_seq
+
+    def record(self, op, *args):
+        """Journal applied command as `[time, op, *args]`, when a journal is kept
+        """
+        if self.journal is not None:
+            self.journal.append([time.time(), op, *args])
+
+    def add_user(self, user_key, user_name, channel_name):
+        added = self.cur_phase.add_user(user_key, user_name, channel_name)
+        if added is not False:
+            self.record('add_user', user_key, user_name, channel_name)
+        return added
+
+    def remove_user(self, user_key):
+        removed = self.cur_phase.remove_user(user_key)
+        if removed is not False:
+            self.record('remove_user', user_key)
+        return removed
+
+    def reconnect_user(self, user_key, channel_name):
+        reconnected = self.cur_phase.reconnect_user(user_key, channel_name)
+        if reconnected:
+            self.record('reconnect_user', user_key, channel_name)
+        return reconnected
+
+    def disconnect_user(self, user_key):
+        disconnected = self.cur_phase.disconnect_user(user_key)
+        if disconnected is not False:
+            self.record('disconnect_user', user_key)
+        return disconnected
+
+    def choose(self, user_key, target, status):
+        chosen = self.cur_phase.choose(user_key, target, status)
+        if chosen:
+            self.record('choose', user_key, target, Choice.Status(status).value)
+        return chosen
+
+    def add_job(self, job_name):
+        added = self.cur_phase.add_job(job_name)
+        if added:
+            self.record('add_job', job_name)
+        return added
+
+    def remove_job(self, job_name):
+        removed = self.cur_phase.remove_job(job_name)
+        if removed:
+            self.record('remove_job', job_name)
+        return removed
+
+    def can_target(self, user, target):
+        return self.cur_phase.choose_limit(user, target.key, Choice.Status.FIXED)
+
+    def next_phase(self, summary=None):
+        self.history.close(summary)
+        self.cur_phase = self.cur_phase.next_phase()
+        # a decided game ends before its next phase is played
+        if self.cur_phase.game_done() is None:
+            self.history.open(self.get_type(), self.status.order)
+        self.phase_seq += 1
+
+    @classmethod
+    def summarize(cls, status, result):
+        """Compact result of a phase for game history
+
+        Arguments:
+            status {int} -- type of the phase
+            result -- result of the phase
+        """
+        if status == 0:
+            return {user.key: user.job.name() for user in result}
+        elif status == 2:
+            return result.key if result else None
+        elif status == 3:
+            return [act.dict() for act in result]
+        return None
+
+    def proceed(self, phase_seq=None):
+        """Move to next phase when current phase is done
+
+        It is idempotent for a given `phase_seq`, so many callers observing the
+        same phase can not advance the room more than once.
+
+        Keyword Arguments:
+            phase_seq {int} -- phase observed by caller, None to skip the check (default: {None})
+
+        Returns:
+            tuple -- (previous phase type, phase result), None when room did not proceed
+        """
+        if phase_seq is not None and phase_seq != self.phase_seq:
+            return None
+        if not self.done():
+            return None
+        prev_status = self.get_type()
+        result = self.result()
+        summary = self.summarize(prev_status, result)
+        self.next_phase(summary)
+        # results of a phase, the seed jobs are shuffled with when the game started
+        self.record('proceed', prev_status, self.status.seed if prev_status == 0 else summary)
+        return prev_status, result
+
+    def expire(self, phase_seq):
+        """Apply default choices when deadline of the phase passed
+
+        Arguments:
+            phase_seq {int} -- phase the deadline was set for
+
+        Returns:
+            bool -- whether any choice is changed
+        """
+        if phase_seq != self.phase_seq:
+            return False
+        expired = self.cur_phase.expire()
+        if expired:
+            self.record('expire')
+        return expired
+
+    def game_done(self):
+        result = self.cur_phase.game_done()
+        if result is not None:
+            seed = self.status.seed
+            self.status = RoomStatus(self.status.room_key, [user for user in self.status.users if user.connected]
+                                     , self.status.jobs, self.status.next_seed())
+            for user in self.status.users:
+                user.init_status()
+            self.history.finish(result.dict(), seed)
+            self.cur_phase = WaitingRoom(self.status)
+            self.history.open(self.get_type(), self.status.order)
+            self.phase_seq += 1
+            self.record('game_done', result.dict())
+        return result
+
+    def type(self):
+        return type(self.cur_phase)
+
+    def dump(self):
+        """Serialize room for room stores
+        """
+        return {
+            'status': self.status.dump(),
+            'phase': self.get_type(),
+            'history': self.history.dump(),
+            'phase_seq': self.phase_seq,
+            'event_seq': self.event_seq,
+            'touched_at': self.touched_at,
+        }
+
+    @classmethod
+    def load(cls, data, version=0):
+        """Restore room from `dump` result
+
+        Arguments:
+            data {dict} -- dumped room
+            version {int} -- version of the stored room
+        """
+        room = cls.__new__(cls)
+        room.status = RoomStatus.load(data['status'])
+        room.cur_phase = PHASE_TYPES[data['phase']].restore(room.status)
+        room.history = GameHistory.load(data['history'])
+        room.phase_seq = data['phase_seq']
+        room.event_seq = data['event_seq']
+        room.touched_at = data['touched_at']
+        room.version = version
+        room.journal = None
+        return room
+
+    @classmethod
+    def replay(cls, room_key, records):
+        """Rebuild room by applying journaled commands in order
+
+        Jobs are shuffled again with the recorded seed of each game. A `create`
+        record starts over with a new room, as room keys are reused after their
+        rooms are deleted. Delivery state such as `event_seq` and `touched_at`
+        is not journaled.
+
+        Arguments:
+            room_key {str} -- room key
+            records {list} -- records of `record`, oldest first
+
+        Raises:
+            ValueError -- record does not apply to the rebuilt room
+        """
+        room = cls(room_key)
+        for number, (_, op, *args) in enumerate(records):
+            if op == 'create':
+                room = cls(room_key, seed=args[0])
+                applied = True
+            elif op == 'proceed':
+                prev_status, result = args
+                applied = room.get_type() == prev_status
+                if applied and prev_status == 0:
+                    room.status.seed = result
+                applied = applied and room.proceed() is not None
+            elif op == 'expire':
+                applied = room.expire(room.phase_seq)
+            elif op == 'game_done':
+                done = room.game_done()
+                applied = done is not None and done.dict() == args[0]
+            else:
+                try:
+                    # commands return False when they do not apply
+                    applied = getattr(room, op)(*args) is not False
+                except (AttributeError, KeyError, TypeError, ValueError):
+                    applied = False
+            if not applied:
+                raise ValueError('record {} {} does not apply to room {}'.format(number, op, room_key))
+        return room
@@ -1,7 +1,6 @@
 import logging
 from game.core.base import *
 from game.core.job import *
-from collections import Counter
 
 
 class RoomProcessor:
@@ -10,11 +9,17 @@ class RoomProcessor:
         self.room_status = room_status
         room_status.clear_choices()
 
+    @classmethod
+    def restore(cls, room_status):
+        """Rebuild processor on loaded room status without clearing choices
+        """
+        processor = cls.__new__(cls)
+        processor.room_status = room_status
+        room_status.type = cls
+        return processor
+
     def get_user(self, user_key):
-        try:
-            return next(user for user in self.room_status.users if user.key == user_key)
-        except StopIteration:
-            return None
+        return self.room_status.get_user(user_key)
 
     def add_user(self, user_key, user_name, channel_name):
         raise NotImplementedError
@@ -49,6 +54,10 @@ class RoomProcessor:
         return user.can_act()
 
     def choose(self, user_key, target, status):
+        try:
+            hash(target)
+        except TypeError:
+            return False
         user = self.get_user(user_key)
         if user and self.choose_limit(user, target, status):
             self.room_status.choose(user, target, status)
@@ -74,6 +83,26 @@ class RoomProcessor:
     def get_type(self):
         raise NotImplementedError
 
+    def expire(self):
+        """Fix choices of users who did not fix theirs, when deadline of phase passed
+
+        Returns:
+            bool -- whether any choice is fixed
+        """
+        return False
+
+    def fix_pending(self, default):
+        """Fix tentative choices, and default target for choices not made
+        """
+        fixed = False
+        for choice in self.room_status.choices:
+            user = choice.user
+            if user.can_act() and not choice.fixed():
+                target = choice.target if choice.status == Choice.Status.TMP else default
+                self.room_status.choose(user, target, Choice.Status.FIXED)
+                fixed = True
+        return fixed
+
     def game_done(self):
         return self.room_status.game_done()
 
@@ -106,7 +135,7 @@ class WaitingRoom(RoomProcessor):
         self.remove_user(user_key)
 
     def add_job(self, job_name):
-        job = JobEnum.get_by_name(job_name)
+        job = get_job(job_name)
         if job:
             self.room_status.add_job(job)
             return True
@@ -114,7 +143,7 @@ class WaitingRoom(RoomProcessor):
             return False
 
     def remove_job(self, job_name):
-        job = JobEnum.get_by_name(job_name)
+        job = get_job(job_name)
         if job:
             self.room_status.remove_job(job)
             return True
@@ -171,7 +200,7 @@ class DayRoom(RoomProcessor):
         if not self.done():
             return False
         self.room_status.clear_temporary_status()
-        target = Counter(choice.target for choice in self.room_status.choices).most_common(1)[0][0]
+        target = self.room_status.most_common(self.room_status.votes)[0]
         if target == 'election':
             return ElectionRoom(self.room_status)
         else:
@@ -183,6 +212,10 @@ class DayRoom(RoomProcessor):
     def get_type(self):
         return 1
 
+    def expire(self):
+        # skip election
+        return self.fix_pending('night')
+
 
 class ElectionRoom(RoomProcessor):
 
@@ -198,7 +231,8 @@ class ElectionRoom(RoomProcessor):
 
     def choose_limit(self, user, target, status):
         if super().choose_limit(user, target, status):
-            if any(target == user.key and user.can_act() for user in self.room_status.users) and \
+            target_user = self.get_user(target)
+            if target_user and target_user.can_act() and \
                     status in [Choice.Status.FIXED, Choice.Status.TMP]:
                 return True
             elif status == Choice.Status.YET:
@@ -210,9 +244,9 @@ class ElectionRoom(RoomProcessor):
     def result(self):
         if not self.done():
             return False
-        target_key, times = Counter(choice.target for choice in self.room_status.choices).most_common(1)[0]
+        target_key, times = self.room_status.most_common(self.room_status.votes)
         target_user = self.get_user(target_key)
-        if target_user and times > sum(1 for choice in self.room_status.choices if choice.user.can_act())/2:
+        if target_user and times > self.room_status.active_count/2:
             target_user.executed()
             return target_user
         else:
@@ -225,20 +259,9 @@ class ElectionRoom(RoomProcessor):
     def get_type(self):
         return 2
 
-
-class ActionProcessor:
-
-    def __init__(self, act_list):
-        self.act_list = act_list
-        self.act_list.sort(key=lambda act: act[0].order)
-
-    def process(self):
-        result_list = []
-        for job, target in self.act_list:
-            result = job.act(target)
-            if result is not None:
-                result_list.append(result)
-        return result_list
+    def expire(self):
+        # abstain
+        return self.fix_pending(None)
 
 
 class NightRoom(RoomProcessor):
@@ -258,27 +281,23 @@ class NightRoom(RoomProcessor):
             if target is None or status == Choice.Status.YET:
                 return True
             target_user = self.get_user(target)
-            if target_user and user.job.can_target(target_user, self.room_status):
+            if target_user and self.room_status.plan.can_target(user, target_user, self.room_status):
                 return True
         return False
 
     def result(self):
         if not self.done():
             return False
-        action_list = []
-        for job_name in self.room_status.jobs:
-            job = self.room_status.jobs[job_name]['instance']
-            if not job.can_act(self.room_status):
+        # targets do not depend on earlier actions, each job acts as its target is counted
+        result_list = []
+        for job_name, job in self.room_status.plan.acting(self.room_status):
+            votes = self.room_status.job_votes.get(job_name)
+            if not votes:
                 continue
-            try:
-                target_key = Counter(choice.target for choice in self.room_status.choices
-                                     if choice.user.job == job and choice.target is not None).most_common(1)[0][0]
-                if target_key is not None:
-                    action_list.append((job, self.get_user(target_key)))
-            except IndexError:
-                pass
-        processor = ActionProcessor(action_list)
-        return processor.process()
+            result = job.act(self.get_user(self.room_status.most_common(votes)[0]))
+            if result is not None:
+                result_list.append(result)
+        return result_list
 
     def next_phase(self):
         self.room_status.clear_temporary_status()
@@ -288,8 +307,19 @@ class NightRoom(RoomProcessor):
         return DayRoom(self.room_status)
 
     def done(self):
-        return all(choice.status == Choice.Status.FIXED for choice in self.room_status.choices
-                   if choice.user.can_act() and choice.user.job.can_act(self.room_status))
+        return self.room_status.jobs_done(job_name for job_name, _ in self.room_status.plan.acting(self.room_status))
 
     def get_type(self):
         return 3
+
+    def expire(self):
+        # no action
+        return self.fix_pending(None)
+
+
+PHASE_TYPES = {
+    0: WaitingRoom,
+    1: DayRoom,
+    2: ElectionRoom,
+    3: NightRoom,
+}
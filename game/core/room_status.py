@@ -1,7 +1,8 @@
 import logging
-from random import shuffle
+from collections import Counter
+import random
 from game.core.base import *
-from game.core.job import JobEnum
+from game.core.job import ActionPlan, get_job
 
 
 class RoomStatus:
@@ -13,13 +14,16 @@ class RoomStatus:
             'count': 1,
         }
 
-    def __init__(self, room_key, users=None, jobs=None):
+    def __init__(self, room_key, users=None, jobs=None, seed=None):
         self.room_key = room_key
+        # jobs of the game are shuffled by a generator of this seed only
+        self.seed = seed if seed is not None else _seeds.getrandbits(32)
         if users is not None:
             self.users = [User(user.key, user.name, user.channel_name) for user in users]
         else:
             self.users = []
         self.choices = [Choice(user) for user in self.users]
+        self.index()
         if jobs is not None:
             from_jobs = {}
             for job in jobs:
@@ -30,48 +34,196 @@ class RoomStatus:
             self.jobs = from_jobs
         else:
             self.jobs = {
-                JobEnum.citizen.name: RoomStatus.job_default(),
-                JobEnum.police.name: RoomStatus.job_default(),
-                JobEnum.doctor.name: RoomStatus.job_default(),
-                JobEnum.mafia.name: RoomStatus.job_default(),
+                'citizen': RoomStatus.job_default(),
+                'police': RoomStatus.job_default(),
+                'doctor': RoomStatus.job_default(),
+                'mafia': RoomStatus.job_default(),
             }
+        # compiled from assigned jobs, None until the game starts
+        self.plan = None
         self.order = 0
         self.type = None
 
+    def index(self):
+        """Build maps by user key, kept alongside ordered `users` and `choices`
+        """
+        self.user_map = {}
+        self.user_order = {}
+        for order, user in enumerate(self.users):
+            user.room_status = self
+            self.user_map[user.key] = user
+            self.user_order[user.key] = order
+        self.next_user_order = len(self.users)
+        self.choice_map = {choice.user.key: choice for choice in self.choices}
+        self.index_teams()
+        self.count()
+
+    def index_teams(self):
+        """Cache users by job name, rebuilt when jobs are assigned
+        """
+        self.teams = {}
+        for user in self.users:
+            if user.job is not None:
+                self.teams.setdefault(user.job.name(), []).append(user)
+
+    def team(self, user):
+        """Users knowing each other's job with given user, including the user
+        """
+        if user.job is not None and user.job.visible_team():
+            return self.teams[user.job.name()]
+        return [user]
+
+    def count(self):
+        """Rebuild running counters of choices
+
+        Attributes:
+            active_count {int} -- number of users who can act
+            group_active {Counter} -- users who can act, by group of their job
+            pending {Counter} -- not fixed choices of users who can act, by job name
+            votes {dict} -- user keys by target of every choice
+            job_votes {dict} -- user keys by target by job name, without None targets
+        """
+        self.active_count = 0
+        self.group_active = Counter()
+        self.pending = Counter()
+        self.votes = {}
+        self.job_votes = {}
+        for choice in self.choices:
+            self.count_choice(choice, 1)
+
+    def count_choice(self, choice, sign):
+        user = choice.user
+        if user.can_act():
+            self.active_count += sign
+            if user.job is not None:
+                self.group_active[user.job.group] += sign
+            if not choice.fixed():
+                self.pending[self.job_key(user)] += sign
+        self.tally(self.votes, choice.target, user.key, sign)
+        if user.job is not None and choice.target is not None:
+            self.tally(self.job_votes.setdefault(user.job.name(), {}), choice.target, user.key, sign)
+
+    @classmethod
+    def tally(cls, votes, target, user_key, sign):
+        if sign > 0:
+            votes.setdefault(target, set()).add(user_key)
+        else:
+            voters = votes[target]
+            voters.discard(user_key)
+            if not voters:
+                del votes[target]
+
+    @classmethod
+    def job_key(cls, user):
+        return user.job.name() if user.job is not None else None
+
+    def user_changed(self, user, active):
+        """Update counters when user can act or not
+
+        Arguments:
+            user {User} -- changed user
+            active {bool} -- whether user could act before the change
+        """
+        if active == user.can_act():
+            return
+        choice = self.choice_map.get(user.key)
+        if choice is None:
+            return
+        sign = 1 if user.can_act() else -1
+        self.active_count += sign
+        if user.job is not None:
+            self.group_active[user.job.group] += sign
+        if not choice.fixed():
+            self.pending[self.job_key(user)] += sign
+
+    def most_common(self, votes):
+        """Same as `Counter(targets).most_common(1)[0]` over choices in user order
+
+        Ties go to the target chosen by the earliest user, like `Counter` does.
+
+        Raises:
+            IndexError -- no votes
+
+        Returns:
+            tuple -- (target, times)
+        """
+        if not votes:
+            raise IndexError('no votes')
+        times = max(len(voters) for voters in votes.values())
+        candidates = [target for target in votes if len(votes[target]) == times]
+        if len(candidates) > 1:
+            candidates.sort(key=lambda target: min(self.user_order[key] for key in votes[target]))
+        return candidates[0], times
+
     def add_user(self, user):
+        choice = Choice(user)
         self.users.append(user)
-        self.choices.append(Choice(user))
+        self.choices.append(choice)
+        user.room_status = self
+        self.user_map[user.key] = user
+        self.user_order[user.key] = self.next_user_order
+        self.next_user_order += 1
+        self.choice_map[user.key] = choice
+        self.count_choice(choice, 1)
 
     def remove_user(self, user):
+        choice = self.choice_map.pop(user.key)
+        self.count_choice(choice, -1)
         self.users.remove(user)
-        self.choices = [choice for choice in self.choices if choice.user != user]
+        self.choices.remove(choice)
+        user.room_status = None
+        del self.user_map[user.key]
+        del self.user_order[user.key]
+        team = self.teams.get(self.job_key(user))
+        if team is not None:
+            team.remove(user)
+            if not team:
+                del self.teams[self.job_key(user)]
+
+    def get_user(self, user_key):
+        try:
+            return self.user_map.get(user_key)
+        except TypeError:
+            # unhashable key from client
+            return None
+
+    def get_choice(self, user_key):
+        return self.choice_map.get(user_key)
 
     def add_job(self, job):
-        if job.name in self.jobs:
-            self.jobs[job.name]['count'] += 1
+        if job.name() in self.jobs:
+            self.jobs[job.name()]['count'] += 1
         else:
-            self.jobs[job.name] = RoomStatus.job_default()
+            self.jobs[job.name()] = RoomStatus.job_default()
 
     def remove_job(self, job):
-        if job.name in self.jobs:
-            self.jobs[job.name]['count'] -= 1
-            if self.jobs[job.name]['count'] < 1:
-                self.jobs.pop(job.name, None)
+        if job.name() in self.jobs:
+            self.jobs[job.name()]['count'] -= 1
+            if self.jobs[job.name()]['count'] < 1:
+                self.jobs.pop(job.name(), None)
 
     def job_count_list(self):
         return [{'job': job, 'count': self.jobs[job]['count']} for job in self.jobs]
 
     def choose(self, user, target, status):
-        choice = next(choice for choice in self.choices if choice.user == user)
+        choice = self.choice_map[user.key]
+        self.count_choice(choice, -1)
         choice.choose(target, status)
+        self.count_choice(choice, 1)
 
     def choose_done(self):
-        return all(not choice.user.can_act() or choice.status == Choice.Status.FIXED for choice in self.choices)
+        return not any(self.pending.values())
+
+    def jobs_done(self, job_names):
+        """Whether users of given jobs fixed their choices
+        """
+        return not any(self.pending[job_name] for job_name in job_names)
 
     def clear_choices(self):
         for choice in self.choices:
             choice.target = None
             choice.status = Choice.Status.YET
+        self.count()
 
     def increase_order(self):
         self.order += 1
@@ -83,23 +235,83 @@ class RoomStatus:
         if self.can_start():
             job_list = []
             for job in self.jobs:
-                self.jobs[job]['instance'] = JobEnum.get_by_name(job).value()
+                self.jobs[job]['instance'] = get_job(job)()
                 for i in range(self.jobs[job]['count']):
                     job_list.append(job)
-            shuffle(job_list)
+            random.Random(self.seed).shuffle(job_list)
             for user, job_name in zip(self.users, job_list):
                 user.job = self.jobs[job_name]['instance']
+            self.plan = ActionPlan({job: self.jobs[job]['instance'] for job in self.jobs})
+            self.index_teams()
+            # counters are kept by job
+            self.count()
+
+    def next_seed(self):
+        """Seed of the next game in the room, so a room seed pins all of its games
+        """
+        return self.seed + 1
 
     def clear_temporary_status(self):
         for user in self.users:
             user.clear_temporary_status()
 
+    def dump(self):
+        """Serialize room status for room stores
+
+        `type` is left to the owner of the processors
+        """
+        return {
+            'room_key': self.room_key,
+            'users': [user.dump() for user in self.users],
+            'choices': [choice.dump() for choice in self.choices],
+            'jobs': {job: {
+                'count': self.jobs[job]['count'],
+                'shuffled': self.jobs[job]['instance'] is not None,
+            } for job in self.jobs},
+            'order': self.order,
+            'seed': self.seed,
+        }
+
+    @classmethod
+    def load(cls, data):
+        room_status = cls(data['room_key'], jobs={}, seed=data['seed'])
+        instances = {}
+        for job in data['jobs']:
+            instance = None
+            if data['jobs'][job]['shuffled']:
+                instance = get_job(job)()
+                instances[job] = instance
+            room_status.jobs[job] = {
+                'instance': instance,
+                'count': data['jobs'][job]['count'],
+            }
+        room_status.users = [User.load(user, instances) for user in data['users']]
+        user_map = {user.key: user for user in room_status.users}
+        room_status.choices = [Choice.load(choice, user_map[choice['user']]) for choice in data['choices']]
+        if instances:
+            room_status.plan = ActionPlan(instances)
+        room_status.index()
+        room_status.order = data['order']
+        return room_status
+
+    def group_count(self, group):
+        """Number of users who can act in given group
+        """
+        return self.group_active[group]
+
     def game_done(self):
-        try:
-            groups = set(user.job.group for user in self.users)
-            for group in groups:
-                if group.do_win(self):
-                    return group
-        except AttributeError:
+        """Winning group, checked in order of room jobs
+
+        Returns:
+            Group -- None while nobody wins or before jobs are assigned
+        """
+        if self.plan is None:
             return None
+        for group in self.plan.groups:
+            if group.do_win(self):
+                return group
         return None
+
+
+# seeds of rooms created without one
+_seeds = random.SystemRandom()
@@ -0,0 +1,211 @@
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from game.core.base import *
+from game.core.job import get_job
+from game.core.room import Room
+
+PHASE_NAMES = {
+    0: 'waiting',
+    1: 'day',
+    2: 'election',
+    3: 'night',
+}
+
+
+class Bot:
+    """Base class for simulated players
+
+    `choices` returns (target, status) list the user chooses in order during
+    current phase. Scripted players override it.
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def choices(self, room, user):
+        phase = room.get_type()
+        if phase == 0:
+            return [('ready', Choice.Status.FIXED)]
+        if not user.can_act():
+            return []
+        if phase == 1:
+            return self.day(room, user)
+        if phase == 2:
+            return self.election(room, user)
+        if phase == 3 and user.job.can_act(room.status):
+            return self.night(room, user)
+        return []
+
+    def day(self, room, user):
+        return [('night', Choice.Status.FIXED)]
+
+    def election(self, room, user):
+        return [(None, Choice.Status.FIXED)]
+
+    def night(self, room, user):
+        return [(None, Choice.Status.FIXED)]
+
+
+class RandomBot(Bot):
+    """Choose random valid targets, sometimes changing mind before fixing it
+    """
+
+    def day(self, room, user):
+        target = self.rng.choice(['election', 'night'])
+        return self.hesitate(target)
+
+    def election(self, room, user):
+        candidates = [row.key for row in room.get_user_list() if row.can_act()]
+        return self.hesitate(self.rng.choice(candidates + [None]))
+
+    def night(self, room, user):
+        candidates = [row.key for row in room.get_user_list() if room.can_target(user, row)]
+        return self.hesitate(self.rng.choice(candidates) if candidates else None)
+
+    def hesitate(self, target):
+        choices = []
+        if self.rng.random() < 0.3:
+            choices.append((target, Choice.Status.TMP))
+        choices.append((target, Choice.Status.FIXED))
+        return choices
+
+
+class Simulation:
+    """Play games headlessly through `Room`, without sockets and channel layers
+
+    Arguments:
+        players {int} -- number of players per room
+
+    Keyword Arguments:
+        jobs {dict} -- count by job name, rest of players are citizens (default: {None})
+        games {int} -- number of games to play (default: {100})
+        bot {type} -- Bot class of every player (default: {RandomBot})
+        seed {int} -- seed of bots and job shuffling (default: {None})
+        phase_limit {int} -- phases before a game is counted as draw (default: {200})
+        trace {bool} -- trace allocations with tracemalloc, slows down the run (default: {False})
+    """
+
+    def __init__(self, players, jobs=None, games=100, bot=RandomBot, seed=None, phase_limit=200, trace=False):
+        self.players = players
+        self.jobs = self.compose(players, jobs)
+        self.games = games
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.bot = bot(self.rng)
+        self.phase_limit = phase_limit
+        self.trace = trace
+
+    @classmethod
+    def compose(cls, players, jobs=None):
+        if jobs is None:
+            mafia = max(1, players // 4)
+            jobs = {'mafia': mafia, 'doctor': 1, 'police': 1}
+        composed = {job: count for job, count in jobs.items() if count > 0}
+        composed['citizen'] = composed.get('citizen', 0) + players - sum(composed.values())
+        if composed['citizen'] < 0 or any(get_job(job) is None for job in composed):
+            raise ValueError('invalid job composition {} for {} players'.format(jobs, players))
+        return composed
+
+    def new_room(self, number):
+        room = Room('simulation_{}'.format(number), seed=None if self.seed is None else self.seed * 100003 + number)
+        for i in range(self.players):
+            room.add_user('user_{}'.format(i), 'name_{}'.format(i), 'channel_{}'.format(i))
+        room.status.jobs = {}
+        for job, count in self.jobs.items():
+            for _ in range(count):
+                room.add_job(job)
+        return room
+
+    def play(self, room, stats):
+        """Play a game until someone wins
+
+        Returns:
+            str -- winner group, 'draw' when phase limit exceeded
+        """
+        for _ in range(self.phase_limit):
+            for user in list(room.get_user_list()):
+                for target, status in self.bot.choices(room, user):
+                    started = time.perf_counter()
+                    room.choose(user.key, target, status)
+                    stats['choose'].append(time.perf_counter() - started)
+            phase = PHASE_NAMES[room.get_type()]
+            started = time.perf_counter()
+            proceeded = room.proceed()
+            done = room.game_done()
+            stats[phase].append(time.perf_counter() - started)
+            if proceeded is None:
+                raise RuntimeError('room {} is stuck in {}'.format(room.room_key, phase))
+            if done is not None:
+                return done.dict()
+        return 'draw'
+
+    def run(self):
+        """Play all games and report
+
+        Returns:
+            dict -- throughput, latency percentiles in microseconds, wins and allocations
+        """
+        stats = {name: [] for name in ['choose'] + list(PHASE_NAMES.values())}
+        wins = Counter()
+        if self.trace:
+            tracemalloc.start()
+        blocks = sys.getallocatedblocks()
+        started = time.perf_counter()
+        for number in range(self.games):
+            wins[self.play(self.new_room(number), stats)] += 1
+        elapsed = time.perf_counter() - started
+        report = {
+            'players': self.players,
+            'jobs': self.jobs,
+            'games': self.games,
+            'seconds': elapsed,
+            'games_per_sec': self.games / elapsed,
+            'choices': len(stats['choose']),
+            'choices_per_sec': len(stats['choose']) / elapsed,
+            'latency': {name: self.percentiles(values) for name, values in stats.items() if values},
+            'wins': dict(wins),
+            'allocated_blocks': sys.getallocatedblocks() - blocks,
+        }
+        if self.trace:
+            report['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return report
+
+    def memory(self, rooms=100):
+        """Measure resident bytes of rooms in play, with tracemalloc
+
+        Keyword Arguments:
+            rooms {int} -- number of rooms kept at once (default: {100})
+
+        Returns:
+            dict -- total bytes and bytes per player
+        """
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            kept = [self.new_room(number) for number in range(rooms)]
+            for room in kept:
+                for user in room.get_user_list():
+                    room.choose(user.key, 'ready', Choice.Status.FIXED)
+                room.proceed()
+            total = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        return {
+            'players': self.players,
+            'rooms': rooms,
+            'bytes': total,
+            'bytes_per_player': total / (rooms * self.players),
+        }
+
+    @classmethod
+    def percentiles(cls, values, points=(50, 90, 99)):
+        values = sorted(values)
+        result = {'count': len(values)}
+        for point in points:
+            index = min(len(values) - 1, int(len(values) * point / 100))
+            result['p{}'.format(point)] = values[index] * 1e6
+        return result
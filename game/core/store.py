@@ -0,0 +1,366 @@
+import logging
+import msgpack
+from game.core.conf import setting
+from game.core.room import Room
+
+logger = logging.getLogger('mafia')
+
+
+class RoomConflictError(Exception):
+    """Room was saved by someone else between load and save
+    """
+    pass
+
+
+class Unchanged:
+    """Result of an update function which left the room as it was, the room is not saved
+    """
+
+    def __init__(self, result=None):
+        self.result = result
+
+
+class RoomStore:
+    """Base class for room state backends
+
+    Every operation of `RoomHandler` loads a room, changes it and saves it back.
+    Saving compares `Room.version` with the stored one, so concurrent writers
+    (e.g. other daphne workers) can not overwrite each other silently.
+
+    The store also keeps the lobby, user counts of waiting rooms as clients
+    know them, with the sequence number of the last change sent to them. It is
+    kept in process here, backends shared between processes override it.
+
+    Attributes:
+        max_retries {int} -- retry count of `update` on version conflicts
+    """
+
+    max_retries = 5
+
+    def __init__(self):
+        self.lobby_rooms = {}
+        self.lobby_seq = 0
+
+    async def load(self, room_key):
+        """Load room
+
+        Returns:
+            Room -- None when room does not exist
+        """
+        raise NotImplementedError
+
+    async def save(self, room):
+        """Save room when stored version equals `room.version`
+
+        Returns:
+            bool -- False on version conflict
+        """
+        raise NotImplementedError
+
+    async def delete(self, room_key):
+        raise NotImplementedError
+
+    async def exists(self, room_key):
+        return await self.load(room_key) is not None
+
+    async def rooms(self):
+        """Load all rooms
+        """
+        raise NotImplementedError
+
+    async def update(self, room_key, func, create=False):
+        """Apply `func` to room and save it, retrying on version conflicts
+
+        Arguments:
+            room_key {str} -- room key
+            func {callable} -- called with room, must not have side effects outside the room,
+                returns `Unchanged` when it changed nothing, room is not saved when it raises
+
+        Keyword Arguments:
+            create {bool} -- create new room when room does not exist (default: {False})
+
+        Raises:
+            KeyError -- room does not exist
+            RoomConflictError -- conflicts exceed `max_retries`
+
+        Returns:
+            tuple -- (room, result of func)
+        """
+        for _ in range(self.max_retries):
+            room = await self.load(room_key)
+            if room is None:
+                if not create:
+                    raise KeyError(room_key)
+                logger.debug('new room {} is created'.format(room_key))
+                room = Room(room_key)
+            result = func(room)
+            if isinstance(result, Unchanged):
+                if room.version != 0:
+                    return room, result.result
+                # new room is saved anyway
+                result = result.result
+            if await self.save(room):
+                return room, result
+            logger.debug('room {} version conflict, retry'.format(room_key))
+        raise RoomConflictError(room_key)
+
+    async def update_lobby(self, changes):
+        """Apply changes of waiting rooms to the lobby
+
+        Arguments:
+            changes {dict} -- user count by room key, None for rooms not waiting anymore
+
+        Returns:
+            tuple -- (sequence number, deltas), the number is increased only when there are deltas
+        """
+        deltas = []
+        for room_key, num in changes.items():
+            known = self.lobby_rooms.get(room_key)
+            if num is None:
+                if known is not None:
+                    del self.lobby_rooms[room_key]
+                    deltas.append({'op': 'remove', 'name': room_key})
+            elif known != num:
+                self.lobby_rooms[room_key] = num
+                deltas.append({'op': 'update' if known is not None else 'add', 'name': room_key, 'num': num})
+        if deltas:
+            self.lobby_seq += 1
+        return self.lobby_seq, deltas
+
+    async def lobby(self):
+        """Sequence number and user count by room key of the lobby
+        """
+        return self.lobby_seq, dict(self.lobby_rooms)
+
+
+class MemoryRoomStore(RoomStore):
+    """Keep live room objects in process memory
+
+    Fastest backend, but rooms are not shared between processes.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.room_map = {}
+
+    async def load(self, room_key):
+        return self.room_map.get(room_key)
+
+    async def update(self, room_key, func, create=False):
+        # rooms are changed in place, keep what is stored to put back when func fails
+        stored = self.room_map.get(room_key)
+        data = stored.dump() if stored is not None else None
+        try:
+            return await super().update(room_key, func, create)
+        except Exception:
+            if data is not None:
+                self.room_map[room_key] = Room.load(data, stored.version)
+            raise
+
+    async def save(self, room):
+        stored = self.room_map.get(room.room_key)
+        if stored is not None and stored is not room and stored.version != room.version:
+            return False
+        room.version += 1
+        self.room_map[room.room_key] = room
+        return True
+
+    async def delete(self, room_key):
+        self.room_map.pop(room_key, None)
+
+    async def exists(self, room_key):
+        return room_key in self.room_map
+
+    async def rooms(self):
+        return list(self.room_map.values())
+
+
+class SerializedRoomStore(RoomStore):
+    """Base class for backends keeping rooms as serialized bytes
+    """
+
+    def encode(self, room):
+        return msgpack.packb(room.dump(), use_bin_type=True)
+
+    def decode(self, data, version):
+        return Room.load(msgpack.unpackb(data, raw=False), int(version))
+
+
+class LocalRoomStore(SerializedRoomStore):
+    """In-process stand-in of `RedisRoomStore`
+
+    Rooms are serialized on every save, so it behaves like a shared backend
+    (no object is shared between operations) without running redis.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.room_map = {}
+
+    async def load(self, room_key):
+        try:
+            version, data = self.room_map[room_key]
+        except KeyError:
+            return None
+        return self.decode(data, version)
+
+    async def save(self, room):
+        version, _ = self.room_map.get(room.room_key, (0, None))
+        if version != room.version:
+            return False
+        room.version += 1
+        self.room_map[room.room_key] = (room.version, self.encode(room))
+        return True
+
+    async def delete(self, room_key):
+        self.room_map.pop(room_key, None)
+
+    async def exists(self, room_key):
+        return room_key in self.room_map
+
+    async def rooms(self):
+        return [self.decode(data, version) for version, data in self.room_map.values()]
+
+
+class RedisRoomStore(SerializedRoomStore):
+    """Share rooms between processes through redis
+
+    Each room is a hash of `version` and `data`, saved by a lua script
+    comparing versions atomically. The lobby is a hash of user count by room
+    key and a counter, changed together by another script.
+    """
+
+    SAVE_SCRIPT = """
+        local version = redis.call('HGET', KEYS[1], 'version') or '0'
+        if version ~= ARGV[1] then
+            return 0
+        end
+        redis.call('HSET', KEYS[1], 'version', ARGV[2])
+        redis.call('HSET', KEYS[1], 'data', ARGV[3])
+        redis.call('SADD', KEYS[2], ARGV[4])
+        return 1
+    """
+
+    # ARGV holds room key and user count pairs, empty count for removed rooms
+    LOBBY_SCRIPT = """
+        local result = {0}
+        for i = 1, #ARGV, 2 do
+            local known = redis.call('HGET', KEYS[1], ARGV[i])
+            if ARGV[i + 1] == '' then
+                if known then
+                    redis.call('HDEL', KEYS[1], ARGV[i])
+                    table.insert(result, 'remove')
+                    table.insert(result, ARGV[i])
+                    table.insert(result, '')
+                end
+            elseif known ~= ARGV[i + 1] then
+                redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+                table.insert(result, known and 'update' or 'add')
+                table.insert(result, ARGV[i])
+                table.insert(result, ARGV[i + 1])
+            end
+        end
+        if #result > 1 then
+            result[1] = redis.call('INCR', KEYS[2])
+        else
+            result[1] = tonumber(redis.call('GET', KEYS[2]) or '0')
+        end
+        return result
+    """
+
+    def __init__(self, host='redis://localhost:6379', prefix='mafia:'):
+        self.host = host
+        self.prefix = prefix
+        self.pool = None
+
+    async def connection(self):
+        if self.pool is None:
+            import aioredis
+            self.pool = await aioredis.create_redis_pool(self.host)
+        return self.pool
+
+    def room_key(self, room_key):
+        return '{}room:{}'.format(self.prefix, room_key)
+
+    def index_key(self):
+        return '{}rooms'.format(self.prefix)
+
+    def lobby_key(self):
+        return '{}lobby'.format(self.prefix)
+
+    def lobby_seq_key(self):
+        return '{}lobby:seq'.format(self.prefix)
+
+    async def load(self, room_key):
+        redis = await self.connection()
+        stored = await redis.hgetall(self.room_key(room_key))
+        if not stored:
+            return None
+        return self.decode(stored[b'data'], stored[b'version'])
+
+    async def save(self, room):
+        redis = await self.connection()
+        saved = await redis.eval(
+            self.SAVE_SCRIPT,
+            keys=[self.room_key(room.room_key), self.index_key()],
+            args=[room.version, room.version + 1, self.encode(room), room.room_key]
+        )
+        if saved:
+            room.version += 1
+        return bool(saved)
+
+    async def delete(self, room_key):
+        redis = await self.connection()
+        await redis.delete(self.room_key(room_key))
+        await redis.srem(self.index_key(), room_key)
+
+    async def exists(self, room_key):
+        redis = await self.connection()
+        return bool(await redis.exists(self.room_key(room_key)))
+
+    async def rooms(self):
+        redis = await self.connection()
+        rooms = []
+        for room_key in await redis.smembers(self.index_key(), encoding='utf-8'):
+            room = await self.load(room_key)
+            if room is not None:
+                rooms.append(room)
+        return rooms
+
+    async def update_lobby(self, changes):
+        redis = await self.connection()
+        args = []
+        for room_key, num in changes.items():
+            args.extend([room_key, '' if num is None else num])
+        result = await redis.eval(self.LOBBY_SCRIPT, keys=[self.lobby_key(), self.lobby_seq_key()], args=args)
+        deltas = []
+        for i in range(1, len(result), 3):
+            op, room_key, num = (value.decode() for value in result[i:i + 3])
+            if op == 'remove':
+                deltas.append({'op': op, 'name': room_key})
+            else:
+                deltas.append({'op': op, 'name': room_key, 'num': int(num)})
+        return int(result[0]), deltas
+
+    async def lobby(self):
+        redis = await self.connection()
+        transaction = redis.multi_exec()
+        seq = transaction.get(self.lobby_seq_key())
+        rooms = transaction.hgetall(self.lobby_key(), encoding='utf-8')
+        await transaction.execute()
+        return int(await seq or 0), {room_key: int(num) for room_key, num in (await rooms).items()}
+
+
+def get_room_store():
+    """Build room store configured by `MAFIA_ROOM_STORE` setting
+
+    Example:
+        MAFIA_ROOM_STORE = {
+            'BACKEND': 'game.core.store.RedisRoomStore',
+            'CONFIG': {'host': 'redis://localhost:6379'},
+        }
+    """
+    from django.utils.module_loading import import_string
+    config = setting('MAFIA_ROOM_STORE', {})
+    backend = import_string(config.get('BACKEND', 'game.core.store.MemoryRoomStore'))
+    return backend(**config.get('CONFIG', {}))
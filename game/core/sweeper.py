@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from game.core.conf import setting
+
+logger = logging.getLogger('mafia')
+
+
+class RoomSweeper:
+    """Delete rooms nobody used for a while
+
+    Rooms are checked every `interval` seconds against the ttl of their state,
+    counted from `Room.touched_at`. Sweeps are scheduled on the loop only
+    while rooms exist, and started again by the next command of room handler.
+
+    Arguments:
+        handler {RoomHandler} -- handler owning rooms
+
+    Keyword Arguments:
+        waiting {float} -- seconds a waiting room is kept without commands (default: {one hour})
+        playing {float} -- seconds a game is kept without commands (default: {three hours})
+        disconnected {float} -- seconds a room without connected users is kept (default: {five minutes})
+        interval {float} -- seconds between sweeps (default: {60})
+        clock {callable} -- wall clock in seconds, shared by workers (default: {time.time})
+
+    Attributes:
+        evicted {Counter} -- number of deleted rooms by state
+        sizes {deque} -- (time, room count by state) of recent sweeps
+    """
+
+    STATES = ['waiting', 'playing', 'disconnected']
+
+    def __init__(self, handler, waiting=60 * 60, playing=60 * 60 * 3, disconnected=60 * 5, interval=60,
+                 clock=time.time):
+        self.handler = handler
+        self.ttls = {
+            'waiting': waiting,
+            'playing': playing,
+            'disconnected': disconnected,
+        }
+        self.interval = interval
+        self.clock = clock
+        self.evicted = Counter()
+        self.sizes = deque(maxlen=60)
+        self.loop = None
+        self.handle = None
+
+    def start(self):
+        """Schedule next sweep when it is not scheduled on current loop
+        """
+        loop = asyncio.get_event_loop()
+        if self.handle is not None and self.loop is loop:
+            return
+        self.loop = loop
+        self.handle = loop.call_later(self.interval, lambda: asyncio.ensure_future(self.run()))
+
+    async def run(self):
+        self.handle = None
+        try:
+            sizes = await self.sweep()
+        except Exception:
+            logger.exception('Failed to sweep rooms')
+            sizes = None
+        if sizes is None or sum(sizes.values()) > 0:
+            self.start()
+
+    @classmethod
+    def state(cls, room):
+        if not any(user.connected for user in room.get_user_list()):
+            return 'disconnected'
+        return 'waiting' if room.get_type() == 0 else 'playing'
+
+    def expired(self, room, now):
+        """State of room when its ttl passed, None when it is in use
+        """
+        state = self.state(room)
+        return state if now - room.touched_at > self.ttls[state] else None
+
+    async def sweep(self):
+        """Delete expired rooms and report room counts
+
+        Returns:
+            Counter -- number of remaining rooms by state
+        """
+        now = self.clock()
+        sizes = Counter({state: 0 for state in self.STATES})
+        for room in await self.handler.store.rooms():
+            if self.expired(room, now) is None:
+                sizes[self.state(room)] += 1
+                continue
+            # checked again in the actor, a command may have arrived since loading
+            state = await self.handler.evict(room.room_key, lambda cur_room: self.expired(cur_room, now))
+            if state is not None:
+                self.evicted[state] += 1
+            else:
+                sizes[self.state(room)] += 1
+        self.sizes.append((now, sizes))
+        logger.info('rooms waiting={waiting} playing={playing} disconnected={disconnected}'.format(**sizes)
+                    + ' evicted={}'.format(sum(self.evicted.values())))
+        return sizes
+
+
+def get_room_ttls():
+    """Keyword arguments of `RoomSweeper` configured by `MAFIA_ROOM_TTL` setting
+
+    Example:
+        MAFIA_ROOM_TTL = {'waiting': 3600, 'playing': 10800, 'disconnected': 300, 'interval': 60}
+
+    Returns:
+        dict -- None when rooms are not swept
+    """
+    return setting('MAFIA_ROOM_TTL')
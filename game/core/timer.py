@@ -0,0 +1,84 @@
+import asyncio
+import heapq
+import itertools
+import time
+from game.core.conf import setting
+
+# phase names of MAFIA_PHASE_DEADLINES setting, by room type
+PHASE_NAMES = {
+    'day': 1,
+    'election': 2,
+    'night': 3,
+}
+
+
+class DeadlineTimer:
+    """Run coroutine functions at deadlines, from a single task for every room
+
+    Deadlines are kept in a heap and the task sleeps until the earliest one,
+    so waiting rooms cost nothing but their heap entries. The task stops when
+    the heap is empty and starts again on the next `schedule`.
+
+    Keyword Arguments:
+        clock {callable} -- monotonic clock in seconds (default: {time.monotonic})
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.heap = []
+        self.counter = itertools.count()
+        self.loop = None
+        self.task = None
+        self.wakeup = None
+
+    def schedule(self, delay, callback, *args):
+        """Call `callback(*args)` after `delay` seconds
+
+        Returns:
+            list -- entry to cancel the call with
+        """
+        entry = [self.clock() + delay, next(self.counter), callback, args]
+        heapq.heappush(self.heap, entry)
+        loop = asyncio.get_event_loop()
+        if self.task is None or self.task.done() or self.loop is not loop:
+            self.loop = loop
+            self.wakeup = asyncio.Event()
+            self.task = loop.create_task(self.run())
+        elif self.heap[0] is entry:
+            # earlier than the deadline the task sleeps for
+            self.wakeup.set()
+        return entry
+
+    def cancel(self, entry):
+        # removed from the heap when its deadline comes
+        entry[2] = None
+
+    def __len__(self):
+        return sum(1 for entry in self.heap if entry[2] is not None)
+
+    async def run(self):
+        while self.heap:
+            delay = self.heap[0][0] - self.clock()
+            if delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, callback, args = heapq.heappop(self.heap)
+            if callback is not None:
+                asyncio.ensure_future(callback(*args))
+
+
+def get_phase_deadlines():
+    """Seconds of each phase configured by `MAFIA_PHASE_DEADLINES` setting
+
+    Example:
+        MAFIA_PHASE_DEADLINES = {'day': 180, 'election': 60, 'night': 60}
+
+    Returns:
+        dict -- seconds by room type, phases without deadline are left out
+    """
+    config = setting('MAFIA_PHASE_DEADLINES') or {}
+    return {PHASE_NAMES[name]: seconds for name, seconds in config.items() if seconds is not None}
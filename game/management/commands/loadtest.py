@@ -0,0 +1,57 @@
+import asyncio
+import json
+import logging
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+
+class Command(BaseCommand):
+    help = 'Play games through websocket consumers in this process and report throughput and round trips'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=10, help='rooms played concurrently')
+        parser.add_argument('--players', type=int, default=7, help='connections per room')
+        parser.add_argument('--jobs', default=None,
+                            help='job composition e.g. mafia=2,doctor=1,police=1, rest are citizens')
+        parser.add_argument('--games', type=int, default=1, help='games played in a row in each room')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--timeout', type=float, default=60)
+        parser.add_argument('--store', choices=['configured', 'memory', 'local'], default='memory',
+                            help='room store, local serializes rooms like the redis store')
+        parser.add_argument('--layer', choices=['configured', 'memory'], default='memory',
+                            help='channel layer, memory does not need redis')
+
+    def handle(self, *args, **options):
+        jobs = None
+        if options['jobs']:
+            jobs = {}
+            for row in options['jobs'].split(','):
+                job, count = row.split('=')
+                jobs[job.strip()] = int(count)
+        overrides = {}
+        if options['layer'] == 'memory':
+            overrides['CHANNEL_LAYERS'] = {
+                'default': {
+                    'BACKEND': 'channels.layers.InMemoryChannelLayer',
+                    # one slow consumer must not lose broadcasts
+                    'CONFIG': {'capacity': 10000},
+                },
+            }
+        if options['verbosity'] < 2:
+            # debug logs of every consumer call dominate the run
+            logging.getLogger('mafia').setLevel(logging.WARNING)
+        with override_settings(**overrides):
+            from game.core import room_container
+            from game.core.store import LocalRoomStore, MemoryRoomStore
+            from game.socket.loadtest import LoadTest
+            from mafia.routing import application
+            if options['store'] == 'memory':
+                room_container.store = MemoryRoomStore()
+            elif options['store'] == 'local':
+                room_container.store = LocalRoomStore()
+            room_container.seed = options['seed']
+            load_test = LoadTest(application, rooms=options['rooms'], players=options['players'],
+                                 jobs=jobs, games=options['games'], seed=options['seed'],
+                                 timeout=options['timeout'])
+            report = asyncio.get_event_loop().run_until_complete(load_test.run())
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,63 @@
+import json
+import os
+import time
+from django.core.management.base import BaseCommand
+from game.core.gamelog import read_log
+from game.core.room import Room
+from game.core.simulation import Simulation
+
+
+class Command(BaseCommand):
+    help = 'Play headless games through game.core and report throughput and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, nargs='+', default=[5, 10, 30],
+                            help='room sizes to simulate')
+        parser.add_argument('--jobs', default=None,
+                            help='job composition e.g. mafia=2,doctor=1,police=1, rest are citizens')
+        parser.add_argument('--games', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--trace', action='store_true', help='trace allocations with tracemalloc')
+        parser.add_argument('--memory', type=int, default=None, metavar='ROOMS',
+                            help='report resident bytes per player of given number of rooms instead of playing')
+        parser.add_argument('--balance', action='store_true',
+                            help='estimate win probabilities with batched games instead of playing rooms')
+        parser.add_argument('--replay', nargs='+', default=None, metavar='LOG',
+                            help='replay game log files of rooms and report records/sec instead of playing')
+
+    def handle(self, *args, **options):
+        if options['replay']:
+            self.stdout.write(json.dumps([self.replay(path) for path in options['replay']], indent=2))
+            return
+        jobs = None
+        if options['jobs']:
+            jobs = {}
+            for row in options['jobs'].split(','):
+                job, count = row.split('=')
+                jobs[job.strip()] = int(count)
+        reports = []
+        for players in options['players']:
+            if options['balance']:
+                from game.core.balance import BalanceAnalyzer
+                reports.append(BalanceAnalyzer(players, jobs, games=options['games'], seed=options['seed']).run())
+                continue
+            simulation = Simulation(players, jobs, games=options['games'], seed=options['seed'],
+                                    trace=options['trace'])
+            if options['memory'] is not None:
+                reports.append(simulation.memory(options['memory']))
+            else:
+                reports.append(simulation.run())
+        self.stdout.write(json.dumps(reports, indent=2))
+
+    def replay(self, path):
+        records = read_log(path)
+        started = time.perf_counter()
+        room = Room.replay(os.path.basename(path)[:-len('.log')], records)
+        elapsed = time.perf_counter() - started
+        return {
+            'room': room.room_key,
+            'records': len(records),
+            'seconds': elapsed,
+            'records_per_sec': len(records) / elapsed if elapsed else None,
+            'games': len(room.history.games),
+        }
@@ -1,5 +1,7 @@
 import enum
 
+MAIN_GROUP = 'main'
+
 
 class HandlerType(str, enum.Enum):
     MAIN_INITIATED = 'main_initiated'
@@ -25,7 +27,15 @@ class HandlerType(str, enum.Enum):
     CHOOSE_CHANGED = 'choose_changed'
     CANNOT_CHOOSE = 'cannot_choose'
     ROOM_MEMBER_CHANGED = 'room_member_changed'
+    ROOM_MEMBER_REFRESHED = 'room_member_refreshed'
+    REFRESH_MEMBERS = 'refresh_members'
     ROOM_INITIATED = 'room_initiated'
     MAIN_CHANGED = 'main_changed'
     GAME_DONE = 'game_done'
     CONFIRM_REJOIN = 'confirm_rejoin'
+    GET_ROOMS = 'get_rooms'
+    ROOM_RESYNC = 'room_resync'
+    ROOM_CLOSED = 'room_closed'
+    FRAME_SEND = 'frame_send'
+    GET_BALANCE = 'get_balance'
+    JOB_BALANCE = 'job_balance'
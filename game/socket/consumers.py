@@ -1,13 +1,13 @@
 import logging
-import names
 import uuid
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
-from game.core import room_container, job_list
-from game.socket import HandlerType
+from game.core import room_container, identity_store, job_list, name_generator
+from game.core.events import Encoded, encode
+from game.core.identity import new_user_key, read_user_key
+from game.socket import HandlerType, MAIN_GROUP
 import time
 
 logger = logging.getLogger('mafia')
-MAIN_GROUP = 'main'
 
 
 class GameConsumer(AsyncJsonWebsocketConsumer):
@@ -24,16 +24,23 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
         """Connect client
 
         Give random name and accept client. Join to main group
+        Clients without identity cookie get a key kept only for this connection
         """
         logger.debug('connect')
-        self.username = self.scope["session"].get("username", names.get_first_name())
-        self.user_key = self.scope["session"].get("user_key", 'user_{}'.format(uuid.uuid4()))
+        self.user_key = read_user_key(self.scope["cookies"])
+        self.identified = self.user_key is not None
+        identity = await identity_store.load(self.user_key) if self.identified else None
+        if identity is None:
+            identity = {}
+        if not self.identified:
+            self.user_key = new_user_key()
+        self.username = identity.get("username") or name_generator.get_name()
         await self.accept()
         # Enter main        
         await self.main_joined()
         # Check rejoin
-        room_key = self.scope["session"].get("room_key", None)
-        if room_key is not None and room_container.room_exists(room_key):
+        room_key = identity.get("room_key")
+        if room_key is not None and await room_container.room_exists(room_key):
             await self.confirm_rejoin(room_key)
 
     async def disconnect(self, close_code):
@@ -42,18 +49,19 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
         Disconnect client and leave group
         """
         logger.debug('disconnect')
+        room_key = None
         # Leave room
         if self.room_key != MAIN_GROUP:
             logger.debug('leave room {}'.format(self.room_key))
-            self.scope["session"]["room_key"] = self.room_key
+            room_key = self.room_key
             await self.room_left(self.room_key)
-        else:
-            self.scope["session"]["room_key"] = None
         # Leave main also
         await self.main_left()
-        self.scope["session"]["username"] = self.username
-        self.scope["session"]["user_key"] = self.user_key
-        self.scope["session"].save()
+        if self.identified:
+            await identity_store.save(self.user_key, {
+                'username': self.username,
+                'room_key': room_key,
+            })
 
     async def receive_json(self, content, **kwargs):
         logger.debug('receive_json')
@@ -78,6 +86,7 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
 
     async def join_room(self, event):
         """Join room
+        Rejoining client may send `event_seq` of the last event it has seen
         
         Arguments:
             event {dict} -- socket event
@@ -85,7 +94,7 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
         logger.debug('join_room')
         logger.debug(event)
         room = event['room']
-        await self.room_joined(room)
+        await self.room_joined(room, event.get('event_seq'))
 
     async def leave_room(self, event):
         """Leave room
@@ -97,7 +106,6 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
         room = event['room']
         await self.room_left(room)
         await room_container.check_done(room)
-        await self.main_changed()
 
     async def change_name(self, event):
         """Change user name
@@ -129,8 +137,8 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
             event {dict} -- socket event
         """
         logger.debug('add_job')
-        room_container.add_job(self.room_key, event['job'])
-        await self.job_changed(self.room_key)
+        await room_container.add_job(self.room_key, event['job'])
+        await room_container.check_done(self.room_key)
 
     async def remove_job(self, event):
         """Remove job
@@ -139,8 +147,8 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
             event {dict} -- socket event
         """
         logger.debug('remove_job')
-        room_container.remove_job(self.room_key, event['job'])
-        await self.job_changed(self.room_key)
+        await room_container.remove_job(self.room_key, event['job'])
+        await room_container.check_done(self.room_key)
 
     async def get_jobs(self, _):
         """Get job list
@@ -154,6 +162,51 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
             'data': job_list,
         })
 
+    async def get_balance(self, _):
+        """Send win probabilities of room jobs, while room is waiting
+
+        Arguments:
+            event {dict} -- socket event
+        """
+        logger.debug('get_balance')
+        if self.room_key == MAIN_GROUP:
+            return
+        wins = await room_container.job_balance(self.room_key)
+        if wins is None:
+            return
+        await self.send_json({
+            'type': HandlerType.JOB_BALANCE,
+            'wins': wins,
+        })
+
+    async def get_rooms(self, _):
+        """Send full room list, when client missed lobby changes
+
+        Arguments:
+            event {dict} -- socket event
+        """
+        logger.debug('get_rooms')
+        snapshot = await room_container.lobby_snapshot()
+        await self.send_json({
+            'type': HandlerType.MAIN_CHANGED,
+            'seq': snapshot['seq'],
+            'room_list': snapshot['room_list'],
+        })
+
+    async def refresh_members(self, _):
+        """Send every member of room, when client missed member changes
+
+        Arguments:
+            event {dict} -- socket event
+        """
+        logger.debug('refresh_members')
+        if self.room_key == MAIN_GROUP:
+            return
+        await self.send_json({
+            'type': HandlerType.ROOM_MEMBER_REFRESHED,
+            'users': await room_container.room_choice_list(self.room_key),
+        })
+
     async def common_send(self, event):
         """Send messages to client
         
@@ -166,24 +219,35 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
         msg.pop('ret_type', None)
         await self.send_json(msg)
 
+    async def frame_send(self, event):
+        """Forward message encoded once by its sender
+        
+        Arguments:
+            event {dict} -- socket event
+        """
+        await self.send(text_data=event['text'])
+
     ########################
     ### Private Handlers ###
     ########################
 
-    async def choose_changed(self, event):
-        """Alert choose result
-        
+    async def room_closed(self, event):
+        """Move to main group when room is deleted by room sweeper
+
         Arguments:
             event {dict} -- socket event
         """
-        logger.debug('choose_changed')
-        await self.send_json(event)
-        await room_container.check_done(self.room_key)
+        logger.debug('room_closed')
+        if self.room_key != event['room']:
+            return
+        await self.channel_layer.group_discard(self.room_key, self.channel_name)
+        await self.main_joined()
 
     async def main_initiated(self):
         """Send main groups information to client
         """
-        logger.debug('main_intiated')        
+        logger.debug('main_intiated')
+        snapshot = await room_container.lobby_snapshot()
         await self.send_json({
             'type': HandlerType.MAIN_INITIATED,
             'me': {
@@ -191,6 +255,8 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
                 'name': self.username,
             },
             'room': self.room_key,
+            'seq': snapshot['seq'],
+            'room_list': snapshot['room_list'],
         })
 
     async def main_joined(self):
@@ -202,31 +268,16 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
             self.channel_name
         )
         await self.main_initiated()
-        await self.main_changed()
 
     async def main_left(self):
-        """Leave main group and alert
+        """Leave main group
+
+        Room list changes are sent by the lobby index of room container
         """
         await self.channel_layer.group_discard(
             self.room_key,
             self.channel_name
         )
-        await self.main_changed()
-
-    async def main_changed(self):
-        """Send changed main group information to client
-        """
-        logger.debug('main_changed')
-        logger.debug(self.room_key)
-        logger.debug(MAIN_GROUP)
-        await self.channel_layer.group_send(
-            MAIN_GROUP,
-            {
-                'type': HandlerType.COMMON_SEND,
-                'ret_type': HandlerType.MAIN_CHANGED,
-                'room_list': room_container.room_list(),
-            }
-        )
 
     async def room_initiated(self, room):
         """Send room information to client
@@ -235,26 +286,33 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
             room {str} -- group name
         """
         logger.debug('room_initiated')
-        room_status = room_container.get_type(room)
+        # events after this number are not included, client applies them later
+        event_seq = await room_container.get_event_seq(room)
+        room_status = await room_container.get_type(room)
         await self.send_json({
             'type': HandlerType.ROOM_INITIATED,
-            'users': room_container.room_choice_list(room),
-            'jobs': room_container.room_job_list(room),
+            'event_seq': event_seq,
+            'users': await room_container.room_choice_list(room),
+            'jobs': await room_container.room_job_list(room),
             'room': room,
             'room_status': room_status,
-            'team_mates': room_container.get_team_mates(room, self.user_key)
+            'team_mates': await room_container.get_team_mates(room, self.user_key)
                 if room_status != 0 else [],
-            'job': room_container.get_user(room, self.user_key).job.name()
+            'job': (await room_container.get_user(room, self.user_key)).job.name()
                 if room_status != 0 else None,
-            'targets': room_container.get_targets(room, self.user_key)
+            'targets': await room_container.get_targets(room, self.user_key)
                 if room_status == 3 else []
         })
 
-    async def room_joined(self, group):
+    async def room_joined(self, group, event_seq=None):
         """Join new group and alert
+        Rejoining user gets only missed events when they are kept
         
         Arguments:
             group {str} -- group key
+
+        Keyword Arguments:
+            event_seq {int} -- last event client has seen (default: {None})
         """
         logger.debug('room_joined {}'.format(group))
         await self.main_left()
@@ -264,11 +322,20 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
             self.room_key,
             self.channel_name
         )
-        if room_container.get_user(self.room_key, self.user_key):
+        if await room_container.get_user(self.room_key, self.user_key):
             await room_container.reconnect_user(self.room_key, self)
+            missed = await room_container.missed_events(self.room_key, self.user_key, event_seq) \
+                if event_seq is not None else None
+            if missed is not None:
+                await self.send(text_data=encode({
+                    'type': HandlerType.ROOM_RESYNC,
+                    'room': group,
+                    'events': Encoded.join(missed),
+                }))
+                return
         else:
-            await room_container.add_user(self.room_key, self)
-        await self.main_changed()
+            # name is changed when someone in the room has it
+            self.username = await room_container.add_user(self.room_key, self)
         await self.room_initiated(group)
 
     async def room_left(self, group):
@@ -287,22 +354,6 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
         await self.main_joined()
         logger.debug('leave room {}'.format(group))
 
-    async def job_changed(self, group):
-        """Alert job changed result
-        
-        Arguments:
-            event {dict} -- socket event
-        """
-        await self.channel_layer.group_send(
-            group,
-            {
-                'type': HandlerType.COMMON_SEND,
-                'ret_type': HandlerType.JOB_CHANGED,
-                'jobs': room_container.room_job_list(group),
-            }
-        )
-        await room_container.check_done(self.room_key)
-
     async def confirm_rejoin(self, room_key):
         """Confirm rejoin
         
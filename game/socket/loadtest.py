@@ -0,0 +1,251 @@
+import asyncio
+import json
+import random
+import resource
+import time
+from channels.testing import WebsocketCommunicator
+from game.core.simulation import Simulation
+from game.socket import HandlerType
+
+DEFAULT_JOBS = ['citizen', 'police', 'doctor', 'mafia']
+
+
+class LoadClient:
+    """Simulated browser playing through a `GameConsumer` connection
+
+    It reacts to server messages like webpack/src/handler.js does and
+    chooses random valid targets.
+    """
+
+    def __init__(self, load_test, number):
+        self.load_test = load_test
+        self.number = number
+        self.rng = random.Random(None if load_test.seed is None else load_test.seed * 100003 + number)
+        self.communicator = WebsocketCommunicator(load_test.application, '/ws/')
+        self.me = None
+        self.room = None
+        self.users = {}
+        self.jobs = []
+        self.job = None
+        self.status = 0
+        self.phase = None
+        self.sent_at = None
+        self.waiters = {}
+        self.reader = None
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=self.load_test.timeout)
+        if not connected:
+            raise ConnectionError('connection refused')
+        self.reader = asyncio.ensure_future(self.read())
+        await self.wait(HandlerType.MAIN_INITIATED)
+
+    async def disconnect(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        await self.communicator.disconnect()
+
+    async def read(self):
+        while True:
+            # timing out here would cancel the consumer, waiters time out instead
+            message = json.loads(await self.communicator.receive_from(timeout=None))
+            self.load_test.received()
+            handler = getattr(self, 'on_' + message['type'], None)
+            if handler is not None:
+                handler(message)
+            for future in self.waiters.pop(message['type'], []):
+                if not future.done():
+                    future.set_result(message)
+
+    def wait(self, message_type):
+        """Future resolved with next message of given type
+        """
+        future = asyncio.get_event_loop().create_future()
+        self.waiters.setdefault(message_type.value, []).append(future)
+        return future
+
+    async def send(self, content):
+        await self.communicator.send_json_to(content)
+
+    def choose(self, target, status='fixed'):
+        self.sent_at = time.perf_counter()
+        asyncio.ensure_future(self.send({'type': 'choose', 'target': target, 'status': status}))
+
+    def can_act(self):
+        me = self.users.get(self.me)
+        return me is not None and me['status'] != 'dead' and me['connected']
+
+    ################
+    ### Handlers ###
+    ################
+
+    def on_main_initiated(self, message):
+        self.me = message['me']['id']
+
+    def on_room_initiated(self, message):
+        self.room = message['room']
+        self.jobs = message['jobs']
+        self.set_users(message['users'])
+
+    def on_room_member_changed(self, message):
+        for user in message['changed']:
+            self.users[user['id']] = user
+        for user_key in message['removed']:
+            self.users.pop(user_key, None)
+
+    def on_room_member_refreshed(self, message):
+        self.set_users(message['users'])
+        if self.phase is not None:
+            # member statuses of new phase are sent after the phase itself
+            phase, self.phase = self.phase, None
+            self.act(phase)
+
+    def on_job_changed(self, message):
+        self.jobs = message['jobs']
+
+    def on_choose_changed(self, message):
+        if message['user'] == self.me and self.sent_at is not None:
+            self.load_test.rtt.append(time.perf_counter() - self.sent_at)
+            self.sent_at = None
+
+    def on_cannot_choose(self, message):
+        self.sent_at = None
+
+    def on_room_status_changed(self, message):
+        self.status = message['status']
+        if message['prev_status'] == 0:
+            self.job = message['result']['job']
+        self.phase = message
+
+    def on_game_done(self, message):
+        self.status = 0
+        self.job = None
+        self.phase = None
+        self.load_test.games += 1
+
+    def act(self, message):
+        if not self.can_act():
+            return
+        if self.status == 1:
+            self.choose(self.rng.choice(['election', 'night']))
+        elif self.status == 2:
+            candidates = [key for key, user in self.users.items()
+                          if user['status'] != 'dead' and user['connected']]
+            self.choose(self.rng.choice(candidates))
+        elif self.status == 3 and self.job != 'citizen':
+            targets = message['result'].get('targets', [])
+            self.choose(self.rng.choice(targets)['id'] if targets else None)
+
+    def set_users(self, users):
+        self.users = {user['id']: user for user in users}
+
+
+class LoadTest:
+    """Play full games through `mafia.routing.application` in this process
+
+    Arguments:
+        application -- ASGI application to connect to
+
+    Keyword Arguments:
+        rooms {int} -- number of rooms played concurrently (default: {10})
+        players {int} -- connections per room (default: {7})
+        jobs {dict} -- count by job name, rest of players are citizens (default: {None})
+        games {int} -- games played in a row in each room (default: {1})
+        seed {int} -- seed of clients' choices and of rooms, with `RoomHandler.seed` set to it (default: {None})
+        timeout {float} -- seconds without any server message before giving up (default: {60})
+    """
+
+    def __init__(self, application, rooms=10, players=7, jobs=None, games=1, seed=None, timeout=60):
+        self.application = application
+        self.rooms = rooms
+        self.players = players
+        self.jobs = Simulation.compose(players, jobs)
+        self.games_per_room = games
+        self.seed = seed
+        self.timeout = timeout
+        self.messages = 0
+        self.received_at = time.perf_counter()
+        self.games = 0
+        self.rtt = []
+
+    def received(self):
+        self.messages += 1
+        self.received_at = time.perf_counter()
+
+    async def watch(self, task):
+        """Cancel task when server stops sending messages
+
+        Single games can take long when thousands of clients share the loop,
+        so progress of the whole run is watched instead of each wait.
+        """
+        while not task.done():
+            await asyncio.sleep(min(1, self.timeout))
+            if time.perf_counter() - self.received_at > self.timeout:
+                task.cancel()
+
+    async def setup_room(self, clients):
+        host = clients[0]
+        initiated = host.wait(HandlerType.ROOM_INITIATED)
+        if self.seed is None:
+            await host.send({'type': HandlerType.CREATE_ROOM})
+        else:
+            # room keys are part of room seeds, keep them across runs
+            await host.send({'type': HandlerType.JOIN_ROOM, 'room': 'loadtest_{}'.format(host.number)})
+        await initiated
+        for client in clients[1:]:
+            initiated = client.wait(HandlerType.ROOM_INITIATED)
+            await client.send({'type': HandlerType.JOIN_ROOM, 'room': host.room})
+            await initiated
+        changes = []
+        for job in set(DEFAULT_JOBS) | set(self.jobs):
+            count = self.jobs.get(job, 0) - (1 if job in DEFAULT_JOBS else 0)
+            changes += [('add_job' if count > 0 else 'remove_job', job)] * abs(count)
+        for method, job in changes:
+            changed = host.wait(HandlerType.JOB_CHANGED)
+            await host.send({'type': method, 'job': job})
+            await changed
+
+    async def play_room(self, clients):
+        await self.setup_room(clients)
+        for _ in range(self.games_per_room):
+            done = [client.wait(HandlerType.GAME_DONE) for client in clients]
+            for client in clients:
+                client.choose('ready')
+            await asyncio.gather(*done)
+
+    async def run(self):
+        """Connect all clients, play games and report
+
+        Returns:
+            dict -- throughput, round trip percentiles in microseconds and memory
+        """
+        clients = [LoadClient(self, number) for number in range(self.rooms * self.players)]
+        started = time.perf_counter()
+        await asyncio.gather(*[client.connect() for client in clients])
+        connected = time.perf_counter()
+        self.messages = 0
+        play = asyncio.ensure_future(asyncio.gather(*[
+            self.play_room(clients[number * self.players:(number + 1) * self.players])
+            for number in range(self.rooms)
+        ]))
+        watch = asyncio.ensure_future(self.watch(play))
+        try:
+            await play
+        except asyncio.CancelledError:
+            raise TimeoutError('no message from server for {} seconds'.format(self.timeout))
+        finally:
+            watch.cancel()
+            played = time.perf_counter()
+            await asyncio.gather(*[client.disconnect() for client in clients], return_exceptions=True)
+        return {
+            'connections': len(clients),
+            'rooms': self.rooms,
+            'jobs': self.jobs,
+            'connect_seconds': connected - started,
+            'games': self.games // self.players,
+            'seconds': played - connected,
+            'messages': self.messages,
+            'messages_per_sec': self.messages / (played - connected),
+            'rtt': Simulation.percentiles(self.rtt) if self.rtt else None,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
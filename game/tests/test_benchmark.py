@@ -0,0 +1,95 @@
+import logging
+from django.test import TestCase
+from game.core.balance import BalanceAnalyzer
+from game.core.simulation import *
+
+logger = logging.getLogger('mafia')
+
+
+class FixedBot(Bot):
+    """Vote every day, then choose first other alive user for election and night
+    """
+
+    def day(self, room, user):
+        return [('election', Choice.Status.FIXED)]
+
+    def election(self, room, user):
+        return [(next(row.key for row in room.get_user_list() if row.can_act() and row is not user),
+                 Choice.Status.FIXED)]
+
+    def night(self, room, user):
+        return [(next(row.key for row in room.get_user_list() if room.can_target(user, row) and row is not user),
+                 Choice.Status.FIXED)]
+
+
+class SimulationTest(TestCase):
+
+    def test_compose(self):
+        self.assertDictEqual(Simulation.compose(8), {'mafia': 2, 'doctor': 1, 'police': 1, 'citizen': 4})
+        self.assertDictEqual(Simulation.compose(5, {'mafia': 1}), {'mafia': 1, 'citizen': 4})
+        with self.assertRaises(ValueError):
+            Simulation.compose(3, {'mafia': 4})
+        with self.assertRaises(ValueError):
+            Simulation.compose(5, {'wizard': 1})
+
+    def test_scripted_games(self):
+        report = Simulation(6, games=5, bot=FixedBot, seed=1).run()
+        self.assertEqual(sum(report['wins'].values()), 5)
+        self.assertEqual(report['latency']['waiting']['count'], 5)
+
+    def test_seeded_games_repeat(self):
+        first = Simulation(8, games=20, seed=7).run()
+        second = Simulation(8, games=20, seed=7).run()
+        self.assertDictEqual(first['wins'], second['wins'])
+        self.assertEqual(first['choices'], second['choices'])
+
+
+class BenchmarkTest(TestCase):
+    """Core throughput by room size, reported to the log on every test run
+    """
+
+    sizes = [5, 10, 30, 50]
+
+    def test_room_sizes(self):
+        for players in self.sizes:
+            report = Simulation(players, games=20, seed=players).run()
+            self.assertEqual(sum(report['wins'].values()), 20)
+            logger.info('benchmark players={players} games/sec={games_per_sec:.1f} '
+                        'choices/sec={choices_per_sec:.1f} allocated_blocks={allocated_blocks}'.format(**report))
+            for phase, latency in report['latency'].items():
+                logger.info('benchmark players={} {} p50={p50:.1f}us p90={p90:.1f}us p99={p99:.1f}us'
+                            .format(players, phase, **latency))
+
+    def test_memory(self):
+        for players in self.sizes:
+            report = Simulation(players, seed=players).memory(rooms=50)
+            logger.info('benchmark players={players} rooms={rooms} bytes/player={bytes_per_player:.0f}'
+                        .format(**report))
+        room = Simulation(5, seed=1).new_room(0)
+        user = room.get_user_list()[0]
+        for resident in [user, room.status.get_choice(user.key)]:
+            self.assertFalse(hasattr(resident, '__dict__'))
+
+
+class BalanceTest(TestCase):
+
+    def test_odds(self):
+        # two alive users of three vote election twice, or tie with night and the dead user's vote
+        self.assertAlmostEqual(BalanceAnalyzer.election_odds(3)[2], 1 / 4 + 1 / 2 / 3)
+        # two voters pick each other, themselves or nobody and need both votes
+        self.assertAlmostEqual(BalanceAnalyzer.execution_odds(3)[2], 2 / 9)
+        # with two dead users voting nobody, both votes only tie with nobody
+        self.assertAlmostEqual(BalanceAnalyzer.execution_odds(4)[2], 1 / 9)
+
+    def test_agrees_with_simulation(self):
+        for players, jobs in [(6, None), (5, {'mafia': 1})]:
+            played = Simulation(players, jobs, games=400, seed=players).run()['wins']
+            report = BalanceAnalyzer(players, jobs, games=200000, seed=players).run()
+            self.assertAlmostEqual(sum(report['wins'].values()), 1)
+            self.assertAlmostEqual(report['wins']['mafia_group'], played.get('mafia_group', 0) / 400, delta=0.08)
+            logger.info('benchmark balance players={players} games={games} seconds={seconds:.2f}'.format(**report))
+
+    def test_seeded_games_repeat(self):
+        first = BalanceAnalyzer(8, games=1000, seed=7, batch=300).run()
+        second = BalanceAnalyzer(8, games=1000, seed=7, batch=300).run()
+        self.assertDictEqual(first['wins'], second['wins'])
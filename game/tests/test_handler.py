@@ -0,0 +1,471 @@
+import asyncio
+import json
+import tempfile
+import time
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.test import TestCase, override_settings
+from game.core.base import *
+from game.core.events import EventLog
+from game.core.gamelog import GameLog
+from game.core.handler import RoomHandler
+from game.core.lobby import LobbyIndex
+from game.core.room import Room
+from game.core.room_processor import *
+from game.core.store import LocalRoomStore, MemoryRoomStore
+from game.core.sweeper import RoomSweeper
+from game.core.timer import DeadlineTimer
+from game.socket import HandlerType
+
+
+class Channel:
+
+    def __init__(self, user_key, username, channel_name):
+        self.user_key = user_key
+        self.username = username
+        self.channel_name = channel_name
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class RoomHandlerTest(TestCase):
+
+    room_key = 'room_name'
+
+    def setUp(self):
+        self.handler = RoomHandler()
+
+    async def join(self, count):
+        layer = get_channel_layer()
+        channels = []
+        for i in range(count):
+            channel = Channel('key{}'.format(i), 'name{}'.format(i), await layer.new_channel())
+            await layer.group_add(self.room_key, channel.channel_name)
+            await self.handler.add_user(self.room_key, channel)
+            channels.append(channel)
+        return channels
+
+    async def receive_all(self, channel_name):
+        layer = get_channel_layer()
+        messages = []
+        while True:
+            try:
+                message = await asyncio.wait_for(layer.receive(channel_name), 0.01)
+                # as the client receives it
+                messages.append(json.loads(message['text']) if message['type'] == HandlerType.FRAME_SEND
+                                else message)
+            except asyncio.TimeoutError:
+                return messages
+
+    def test_concurrent_choices_proceed_once(self):
+        async def run():
+            channels = await self.join(4)
+            await asyncio.gather(*[
+                self.handler.choose(self.room_key, channel.user_key, 'ready', 'fixed') for channel in channels
+            ])
+            # phase check may still be sending, actors stop when their inbox is empty
+            await asyncio.gather(*[actor.task for actor in list(self.handler.actors.values())])
+            self.assertDictEqual(self.handler.actors, {})
+            return [await self.receive_all(channel.channel_name) for channel in channels]
+
+        for messages in async_to_sync(run)():
+            changed = [message for message in messages
+                       if message['type'] == HandlerType.ROOM_STATUS_CHANGED]
+            self.assertEqual(len(changed), 1)
+            self.assertEqual(changed[0]['status'], 1)
+        self.assertEqual(async_to_sync(self.handler.get_type)(self.room_key), 1)
+
+    def test_commands_applied_in_order(self):
+        async def run():
+            await self.join(2)
+            await asyncio.gather(
+                self.handler.choose(self.room_key, 'key0', 'ready', 'fixed'),
+                self.handler.choose(self.room_key, 'key0', None, 'yet'),
+                self.handler.choose(self.room_key, 'key1', 'ready', 'fixed'),
+            )
+            return await self.handler.room_choice_list(self.room_key)
+
+        users = async_to_sync(run)()
+        self.assertEqual(users[0]['choice']['status'], Choice.Status.YET.value)
+        self.assertEqual(users[1]['choice']['status'], Choice.Status.FIXED.value)
+        self.assertEqual(async_to_sync(self.handler.get_type)(self.room_key), 0)
+
+    def test_choice_saved_once(self):
+        async def run():
+            await self.join(2)
+            before = (await self.handler.store.load(self.room_key)).version
+            await self.handler.choose(self.room_key, 'key0', 'ready', 'fixed')
+            return before, (await self.handler.store.load(self.room_key)).version
+
+        before, after = async_to_sync(run)()
+        # phase check which did not proceed is not saved
+        self.assertEqual(after, before + 1)
+
+    def test_failed_command_not_saved(self):
+        def fail(room):
+            room.add_job('mafia')
+            raise ValueError('failed halfway')
+
+        async def run():
+            await self.join(2)
+            before = await self.handler.store.load(self.room_key)
+            version, jobs = before.version, before.get_job_list()
+            results = await asyncio.gather(
+                self.handler.execute(self.room_key, fail),
+                self.handler.execute(self.room_key, lambda room: room.add_job('doctor')),
+                return_exceptions=True)
+            after = await self.handler.store.load(self.room_key)
+            return results, version, jobs, after
+
+        for store in [MemoryRoomStore(), LocalRoomStore()]:
+            self.handler = RoomHandler(store)
+            results, version, jobs, after = async_to_sync(run)()
+            self.assertIsInstance(results[0], ValueError)
+            self.assertTrue(results[1])
+            # only the other command of the batch is saved
+            self.assertEqual(after.version, version + 1)
+            counts = {row['job']: row['count'] for row in after.get_job_list()}
+            self.assertEqual(counts['mafia'], {row['job']: row['count'] for row in jobs}['mafia'])
+            self.assertEqual(counts['doctor'], {row['job']: row['count'] for row in jobs}['doctor'] + 1)
+
+    def test_unique_names(self):
+        async def run():
+            first = Channel('key0', 'James', 'channel0')
+            second = Channel('key1', 'James', 'channel1')
+            return await self.handler.add_user(self.room_key, first), \
+                await self.handler.add_user(self.room_key, second)
+
+        first, second = async_to_sync(run)()
+        self.assertEqual(first, 'James')
+        self.assertNotEqual(second, 'James')
+        self.assertEqual(async_to_sync(self.handler.get_user)(self.room_key, 'key1').name, second)
+
+    def test_night_choice_sent_to_team(self):
+        async def run():
+            channels = await self.join(4)
+            for target in ['ready', 'night']:
+                for channel in channels:
+                    await self.handler.choose(self.room_key, channel.user_key, target, 'fixed')
+            for channel in channels:
+                await self.receive_all(channel.channel_name)
+            room = await self.handler.store.load(self.room_key)
+            mafia = next(user for user in room.get_user_list() if user.job.name() == 'mafia')
+            target = next(user for user in room.get_user_list() if user is not mafia)
+            await self.handler.choose(self.room_key, mafia.key, target.key, 'fixed')
+            return mafia, {channel.channel_name: await self.receive_all(channel.channel_name)
+                           for channel in channels}
+
+        mafia, messages = async_to_sync(run)()
+        for channel_name, received in messages.items():
+            changed = [message for message in received if message['type'] == HandlerType.CHOOSE_CHANGED]
+            self.assertEqual(len(changed), 1 if channel_name == mafia.channel_name else 0)
+
+    def test_phase_deadline(self):
+        async def run():
+            self.handler.deadlines = {1: 0.01, 2: 0.01}
+            channels = await self.join(4)
+            await self.handler.choose(self.room_key, 'key0', 'election', 'fixed')
+            for channel in channels:
+                await self.handler.choose(self.room_key, channel.user_key, 'ready', 'fixed')
+            for _ in range(100):
+                if await self.handler.get_type(self.room_key) == 3:
+                    break
+                await asyncio.sleep(0.01)
+            return await self.handler.get_type(self.room_key), len(self.handler.timer)
+
+        room_type, scheduled = async_to_sync(run)()
+        # day skips election, night has no deadline
+        self.assertEqual(room_type, 3)
+        self.assertEqual(scheduled, 0)
+
+    def test_sweep(self):
+        async def run():
+            sweeper = RoomSweeper(self.handler, waiting=10, playing=100, disconnected=1)
+            channels = await self.join(2)
+            await self.handler.add_user('abandoned', Channel('key9', 'name9', 'channel9'))
+            await self.handler.disconnect_user('abandoned', 'key9')
+            await self.handler.add_user('gone', Channel('key8', 'name8', 'channel8'))
+            room = await self.handler.store.load('gone')
+            # users left without a message, e.g. worker stopped
+            room.get_user('key8').connected = False
+            kept = await sweeper.sweep()
+            for channel in channels:
+                await self.receive_all(channel.channel_name)
+            sweeper.clock = lambda: time.time() + 11
+            swept = await sweeper.sweep()
+            return kept, swept, sweeper.evicted, await self.receive_all(channels[0].channel_name)
+
+        kept, swept, evicted, messages = async_to_sync(run)()
+        self.assertDictEqual(dict(kept), {'waiting': 1, 'playing': 0, 'disconnected': 1})
+        self.assertDictEqual(dict(swept), {'waiting': 0, 'playing': 0, 'disconnected': 0})
+        self.assertDictEqual(dict(evicted), {'waiting': 1, 'disconnected': 1})
+        self.assertListEqual(messages, [{'type': HandlerType.ROOM_CLOSED, 'room': self.room_key}])
+        self.assertFalse(async_to_sync(self.handler.room_exists)(self.room_key))
+
+    def test_process_results(self):
+        room = Room(self.room_key)
+        for i in range(6):
+            room.add_user('key{}'.format(i), 'name{}'.format(i), 'channel{}'.format(i))
+        room.add_job('mafia')
+        room.add_job('citizen')
+        for user in room.get_user_list():
+            room.choose(user.key, 'ready', Choice.Status.FIXED)
+        room.get_user('key5').connected = False
+        prev_status, result = room.proceed()
+        messages = {user.channel_name: message
+                    for user, message in self.handler.process_results(room, prev_status, result)}
+        self.assertNotIn('channel5', messages)
+        mafia = [user for user in room.get_user_list() if user.job.name() == 'mafia']
+        for user in room.get_user_list()[:5]:
+            processed = messages[user.channel_name]['result']
+            self.assertEqual(processed['job'], user.job.name())
+            if user in mafia:
+                self.assertListEqual(processed['team_mates'], [row.dict() for row in mafia])
+                # encoded once for the team
+                self.assertIs(messages[user.channel_name], messages[mafia[0].channel_name])
+            else:
+                self.assertListEqual(processed['team_mates'], [user.dict()])
+
+    def test_member_changes(self):
+        async def run():
+            channels = await self.join(4)
+            for channel in channels:
+                await self.receive_all(channel.channel_name)
+            await self.handler.remove_user(self.room_key, channels[3])
+            removed = await self.receive_all(channels[0].channel_name)
+            for channel in channels[:3]:
+                await self.handler.choose(self.room_key, channel.user_key, 'ready', 'fixed')
+            await self.handler.remove_job(self.room_key, 'citizen')
+            await self.handler.check_done(self.room_key)
+            await self.handler.remove_user(self.room_key, channels[2])
+            return removed, await self.receive_all(channels[0].channel_name)
+
+        removed, started = async_to_sync(run)()
+        self.assertEqual(removed[0]['type'], HandlerType.ROOM_MEMBER_CHANGED)
+        self.assertListEqual(removed[0]['changed'], [])
+        self.assertListEqual(removed[0]['removed'], ['key3'])
+        refreshed, changed = [message for message in started if message['type'] in [
+            HandlerType.ROOM_MEMBER_REFRESHED, HandlerType.ROOM_MEMBER_CHANGED]][-2:]
+        self.assertEqual(refreshed['type'], HandlerType.ROOM_MEMBER_REFRESHED)
+        self.assertEqual(len(refreshed['users']), 3)
+        # user left while playing stays in room
+        self.assertListEqual([user['id'] for user in changed['changed']], ['key2'])
+        self.assertFalse(changed['changed'][0]['connected'])
+
+    def test_job_balance(self):
+        async def run():
+            await self.join(4)
+            first = await self.handler.job_balance(self.room_key, games=1000)
+            second = await self.handler.job_balance(self.room_key, games=1000)
+            return first, second
+
+        first, second = async_to_sync(run)()
+        self.assertAlmostEqual(sum(first.values()), 1)
+        # same composition is played once
+        self.assertIs(first, second)
+
+    def test_game_log(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.handler = RoomHandler(game_log=GameLog(directory.name, window=0))
+
+        async def run():
+            channels = await self.join(3)
+            await self.handler.remove_job(self.room_key, 'citizen')
+            for channel in channels:
+                await self.handler.choose(self.room_key, channel.user_key, 'ready', 'fixed')
+            await self.handler.check_done(self.room_key)
+            await self.handler.remove_user(self.room_key, channels[2])
+            await self.handler.game_log.flush()
+            return await self.handler.store.load(self.room_key)
+
+        room = async_to_sync(run)()
+        records = self.handler.game_log.read(self.room_key)
+        self.assertListEqual([record[1] for record in records[:6]],
+                             ['create', 'add_user', 'add_user', 'add_user', 'remove_job', 'choose'])
+        replayed = self.handler.game_log.replay(self.room_key)
+        self.assertEqual(replayed.type(), DayRoom)
+        self.assertDictEqual(replayed.status.dump(), room.status.dump())
+        self.assertEqual(self.handler.game_log.replay(self.room_key, until=3).type(), WaitingRoom)
+
+    def test_game_log_reused_key(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.handler = RoomHandler(game_log=GameLog(directory.name, window=0))
+
+        async def run():
+            channels = await self.join(4)
+            for channel in channels:
+                await self.handler.choose(self.room_key, channel.user_key, 'ready', 'fixed')
+            # room in game is deleted when its users are gone, then its key is taken again
+            for channel in channels:
+                await self.handler.disconnect_user(self.room_key, channel.user_key)
+            await self.join(2)
+            await self.handler.game_log.flush()
+            return await self.handler.store.load(self.room_key)
+
+        room = async_to_sync(run)()
+        replayed = self.handler.game_log.replay(self.room_key)
+        self.assertEqual(replayed.type(), WaitingRoom)
+        self.assertDictEqual(replayed.status.dump(), room.status.dump())
+
+    def test_seeded_rooms(self):
+        async def run():
+            await self.join(1)
+            return await self.handler.store.load(self.room_key)
+
+        self.handler.seed = 3
+        first = async_to_sync(run)()
+        self.handler = RoomHandler()
+        self.handler.seed = 3
+        self.assertEqual(async_to_sync(run)().status.seed, first.status.seed)
+
+    def test_missed_events(self):
+        async def run():
+            channels = await self.join(4)
+            seq = await self.handler.get_event_seq(self.room_key)
+            await self.handler.remove_user(self.room_key, channels[3])
+            for channel in channels[:3]:
+                await self.handler.choose(self.room_key, channel.user_key, 'ready', 'fixed')
+            await self.handler.add_job(self.room_key, 'citizen')
+            return seq, await self.handler.missed_events(self.room_key, 'key0', seq), \
+                await self.handler.missed_events(self.room_key, 'key0', 0)
+
+        seq, missed, old = async_to_sync(run)()
+        missed = [json.loads(message) for message in missed]
+        old = [json.loads(message) for message in old]
+        self.assertListEqual([message['type'] for message in missed], [
+            HandlerType.ROOM_MEMBER_CHANGED,
+            HandlerType.CHOOSE_CHANGED, HandlerType.CHOOSE_CHANGED, HandlerType.CHOOSE_CHANGED,
+            HandlerType.JOB_CHANGED,
+        ])
+        self.assertListEqual([message['event_seq'] for message in missed], list(range(seq + 1, seq + 6)))
+        # room is created without event, every event is kept
+        self.assertListEqual([message['event_seq'] for message in old], list(range(1, seq + 6)))
+        self.assertEqual(old[-len(missed):], missed)
+
+    def test_missed_phase_change(self):
+        async def run():
+            channels = await self.join(4)
+            for channel in channels:
+                await self.handler.choose(self.room_key, channel.user_key, 'ready', 'fixed')
+            # a citizen is away during day and back at night, the game goes on without them
+            room = await self.handler.store.load(self.room_key)
+            away = next(channel for channel in channels if room.get_user(channel.user_key).job.name() != 'mafia')
+            present = next(channel for channel in channels if channel is not away)
+            await self.handler.disconnect_user(self.room_key, away.user_key)
+            seq = await self.handler.get_event_seq(self.room_key)
+            for channel in channels:
+                if channel is not away:
+                    await self.handler.choose(self.room_key, channel.user_key, 'night', 'fixed')
+            self.assertEqual(await self.handler.get_type(self.room_key), 3)
+            await self.handler.reconnect_user(self.room_key, away)
+            return seq, await self.handler.missed_events(self.room_key, away.user_key, seq), \
+                await self.handler.missed_events(self.room_key, present.user_key, seq)
+
+        seq, missed, received = async_to_sync(run)()
+        # phase changed while away, the client needs a snapshot
+        self.assertIsNone(missed)
+        self.assertIn(HandlerType.ROOM_STATUS_CHANGED,
+                      [json.loads(message)['type'] for message in received])
+
+
+class DeadlineTimerTest(TestCase):
+
+    def test_schedule(self):
+        async def run():
+            timer = DeadlineTimer()
+            called = []
+
+            async def call(name):
+                called.append(name)
+
+            timer.schedule(0.03, call, 'late')
+            timer.schedule(0.01, call, 'early')
+            timer.cancel(timer.schedule(0.02, call, 'cancelled'))
+            self.assertEqual(len(timer), 2)
+            await timer.task
+            await asyncio.sleep(0)
+            return called, timer.task
+
+        called, task = async_to_sync(run)()
+        self.assertListEqual(called, ['early', 'late'])
+        self.assertTrue(task.done())
+
+
+class EventLogTest(TestCase):
+
+    def test_since(self):
+        log = EventLog(size=3)
+        log.record(1, {'event_seq': 1})
+        log.record(2, {'event_seq': 2}, {'key0'})
+        log.record(2, {'event_seq': 2}, {'key1'})
+        self.assertListEqual(log.since(0, 'key1'), [{'event_seq': 1}, {'event_seq': 2}])
+        self.assertListEqual(log.since(2, 'key1'), [])
+        log.record(3, {'event_seq': 3})
+        self.assertIsNone(log.since(0, 'key1'))
+        self.assertListEqual(log.since(1, 'key1'), [{'event_seq': 2}, {'event_seq': 3}])
+        # events applied by another worker
+        log.record(5, {'event_seq': 5})
+        self.assertIsNone(log.since(3, 'key1'))
+        self.assertListEqual(log.since(4, 'key1'), [{'event_seq': 5}])
+        # users missing from every content of a phase change
+        log.record(6, {'event_seq': 6}, {'key0'}, variant=True)
+        log.record(6, {'event_seq': 6, 'job': 'mafia'}, {'key1'}, variant=True)
+        self.assertListEqual(log.since(5, 'key1'), [{'event_seq': 6, 'job': 'mafia'}])
+        self.assertIsNone(log.since(5, 'key2'))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class LobbyIndexTest(TestCase):
+
+    def test_merge_changes(self):
+        async def run():
+            lobby = LobbyIndex(RoomHandler(), window=0)
+            layer = get_channel_layer()
+            channel_name = await layer.new_channel()
+            await layer.group_add(lobby.group, channel_name)
+            first, second = Room('first'), Room('second')
+            first.add_user('key0', 'name0', 'channel0')
+            lobby.track(first)
+            await lobby.flush()
+            # merged into single delta
+            first.add_user('key1', 'name1', 'channel1')
+            lobby.track(first)
+            second.add_user('key2', 'name2', 'channel2')
+            lobby.track(second)
+            lobby.track_removed('second')
+            await lobby.flush()
+            return [json.loads((await layer.receive(channel_name))['text']) for _ in range(2)]
+
+        added, updated = async_to_sync(run)()
+        self.assertEqual(added['seq'], 1)
+        self.assertListEqual(added['changes'], [{'op': 'add', 'name': 'first', 'num': 1}])
+        self.assertEqual(updated['seq'], 2)
+        self.assertListEqual(updated['changes'], [{'op': 'update', 'name': 'first', 'num': 2}])
+
+    def test_shared_store(self):
+        async def run():
+            # workers sharing a room store
+            store = MemoryRoomStore()
+            first, second = RoomHandler(store), RoomHandler(store)
+            first.lobby.window = second.lobby.window = 0
+            layer = get_channel_layer()
+            channel_name = await layer.new_channel()
+            await layer.group_add(first.lobby.group, channel_name)
+            room = Room('room')
+            room.add_user('key0', 'name0', 'channel0')
+            first.lobby.track(room)
+            await first.lobby.flush()
+            room.add_user('key1', 'name1', 'channel1')
+            second.lobby.track(room)
+            await second.lobby.flush()
+            snapshot = await first.lobby_snapshot()
+            # removed through a worker which never listed it
+            second.lobby.track_removed('room')
+            await second.lobby.flush()
+            return snapshot, [json.loads((await layer.receive(channel_name))['text']) for _ in range(3)]
+
+        snapshot, messages = async_to_sync(run)()
+        self.assertDictEqual(snapshot, {'seq': 2, 'room_list': [{'name': 'room', 'num': 2}]})
+        self.assertListEqual([message['seq'] for message in messages], [1, 2, 3])
+        self.assertListEqual(messages[2]['changes'], [{'op': 'remove', 'name': 'room'}])
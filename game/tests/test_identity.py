@@ -0,0 +1,78 @@
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, override_settings
+from game.core import room_container
+from game.core.identity import IDENTITY_COOKIE, MemoryIdentityStore, read_user_key
+from game.core.store import MemoryRoomStore
+from game.socket import HandlerType
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+)
+class IdentityTest(TestCase):
+
+    def setUp(self):
+        self.store = room_container.store
+        room_container.store = MemoryRoomStore()
+
+    def tearDown(self):
+        room_container.store = self.store
+
+    def test_cookie(self):
+        response = self.client.get('/')
+        cookie = response.cookies[IDENTITY_COOKIE]
+        user_key = read_user_key({IDENTITY_COOKIE: cookie.value})
+        self.assertTrue(user_key.startswith('user_'))
+        self.assertIsNone(read_user_key({IDENTITY_COOKIE: cookie.value + 'x'}))
+        # kept while it is valid
+        self.assertNotIn(IDENTITY_COOKIE, self.client.get('/').cookies)
+
+    def test_rejoin(self):
+        cookie = self.client.get('/').cookies[IDENTITY_COOKIE].value
+        headers = [(b'cookie', '{}={}'.format(IDENTITY_COOKIE, cookie).encode())]
+
+        async def receive(communicator, message_type):
+            while True:
+                message = await communicator.receive_json_from()
+                if message['type'] == message_type:
+                    return message
+
+        async def run():
+            from mafia.routing import application
+            communicator = WebsocketCommunicator(application, '/ws/', headers)
+            await communicator.connect()
+            me = (await receive(communicator, HandlerType.MAIN_INITIATED))['me']
+            await communicator.send_json_to({'type': 'create_room'})
+            room = (await receive(communicator, HandlerType.ROOM_INITIATED))['room']
+            # room is deleted when nobody is in it
+            other = WebsocketCommunicator(application, '/ws/')
+            await other.connect()
+            await other.send_json_to({'type': 'join_room', 'room': room})
+            await receive(other, HandlerType.ROOM_INITIATED)
+            await communicator.disconnect()
+
+            communicator = WebsocketCommunicator(application, '/ws/', headers)
+            await communicator.connect()
+            rejoined = (await receive(communicator, HandlerType.MAIN_INITIATED))['me']
+            confirm = await receive(communicator, HandlerType.CONFIRM_REJOIN)
+            await communicator.disconnect()
+            await other.disconnect()
+            return me, room, rejoined, confirm
+
+        me, room, rejoined, confirm = async_to_sync(run)()
+        self.assertDictEqual(me, rejoined)
+        self.assertEqual(confirm['room'], room)
+
+    def test_memory_store_expiry(self):
+        async def run():
+            store = MemoryIdentityStore(ttl=-1)
+            await store.save('key0', {'username': 'name0', 'room_key': None})
+            expired = await store.load('key0')
+            await store.save('key1', {'username': 'name1', 'room_key': None})
+            return expired, list(store.identities)
+
+        expired, kept = async_to_sync(run)()
+        self.assertIsNone(expired)
+        self.assertListEqual(kept, [])
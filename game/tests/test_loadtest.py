@@ -0,0 +1,26 @@
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+from game.core import room_container
+from game.core.store import MemoryRoomStore
+from game.socket.loadtest import LoadTest
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class LoadTestTest(TestCase):
+
+    def setUp(self):
+        self.store = room_container.store
+        room_container.store = MemoryRoomStore()
+
+    def tearDown(self):
+        room_container.store = self.store
+
+    def test_play(self):
+        from mafia.routing import application
+        load_test = LoadTest(application, rooms=2, players=5, games=2, seed=1, timeout=10)
+        report = async_to_sync(load_test.run)()
+        self.assertEqual(report['connections'], 10)
+        self.assertEqual(report['games'], 4)
+        self.assertGreater(report['rtt']['count'], 0)
+        # every room is deleted after its users leave
+        self.assertEqual(async_to_sync(room_container.store.rooms)(), [])
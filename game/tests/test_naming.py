@@ -0,0 +1,41 @@
+import os
+import random
+import tempfile
+from collections import Counter
+from django.test import TestCase
+from game.core.naming import NameGenerator, name_generator
+
+
+class NameGeneratorTest(TestCase):
+
+    def setUp(self):
+        rows = [('ALPHA', 3.0), ('BETA', 1.0), ('GAMMA', 0.0), ('DELTA', 6.0)]
+        handle, self.filename = tempfile.mkstemp()
+        with os.fdopen(handle, 'w') as name_file:
+            cumulative = 0
+            for rank, (name, frequency) in enumerate(rows, 1):
+                cumulative += frequency
+                name_file.write('{:<15}{:.3f} {:.3f} {}\n'.format(name, frequency, cumulative, rank))
+        self.generator = NameGenerator([self.filename], random.Random(1))
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_weights(self):
+        picked = Counter(self.generator.get_name() for _ in range(10000))
+        self.assertSetEqual(set(picked), {'Alpha', 'Beta', 'Delta'})
+        self.assertAlmostEqual(picked['Delta'] / 10000, 0.6, delta=0.03)
+        self.assertAlmostEqual(picked['Beta'] / 10000, 0.1, delta=0.03)
+
+    def test_taken(self):
+        for _ in range(100):
+            self.assertNotIn(self.generator.get_name({'Alpha', 'Unknown'}), {'Alpha', 'Gamma'})
+            self.assertEqual(self.generator.get_name({'Alpha', 'Delta'}), 'Beta')
+        self.assertIsNone(self.generator.get_name({'Alpha', 'Beta', 'Delta'}))
+
+    def test_unique_in_room(self):
+        taken = set()
+        for _ in range(50):
+            name = name_generator.get_name(taken)
+            self.assertNotIn(name, taken)
+            taken.add(name)
@@ -0,0 +1,300 @@
+import json
+import random
+from collections import Counter
+from django.test import TestCase
+from game.core.base import *
+from game.core.history import GameHistory
+from game.core.job import JOBS, Citizen, register_job
+from game.core.room import Room
+from game.core.room_processor import *
+from game.core.room_status import RoomStatus
+from game.core.simulation import RandomBot, Simulation
+
+
+class RoomTest(TestCase):
+
+    def setUp(self):
+        self.room = Room('room_name')
+        for i in range(4):
+            self.room.add_user('key{}'.format(i), 'name{}'.format(i), 'channel{}'.format(i))
+
+    def test_proceed_once_per_phase(self):
+        phase_seq = self.room.phase_seq
+        self.assertIsNone(self.room.proceed(phase_seq))
+        for user in self.room.get_user_list():
+            self.room.choose(user.key, 'ready', Choice.Status.FIXED)
+        prev_status, result = self.room.proceed(phase_seq)
+        self.assertEqual(prev_status, 0)
+        self.assertEqual(self.room.type(), DayRoom)
+        # every member observed the same phase, only the first one proceeds
+        for user in self.room.get_user_list():
+            self.room.choose(user.key, 'night', Choice.Status.FIXED)
+        self.assertIsNone(self.room.proceed(phase_seq))
+        self.assertEqual(self.room.type(), DayRoom)
+        self.assertIsNotNone(self.room.proceed(self.room.phase_seq))
+        self.assertEqual(self.room.type(), NightRoom)
+
+    def test_expire(self):
+        for user in self.room.get_user_list():
+            self.room.choose(user.key, 'ready', Choice.Status.FIXED)
+        self.room.proceed()
+        phase_seq = self.room.phase_seq
+        self.room.choose('key0', 'election', Choice.Status.FIXED)
+        self.assertFalse(self.room.expire(phase_seq - 1))
+        self.assertTrue(self.room.expire(phase_seq))
+        self.assertEqual(self.room.status.get_choice('key1').target, 'night')
+        self.room.proceed(phase_seq)
+        self.assertEqual(self.room.type(), NightRoom)
+        mafia = next(user for user in self.room.get_user_list() if user.job.name() == 'mafia')
+        self.room.choose(mafia.key, 'key0' if mafia.key != 'key0' else 'key1', Choice.Status.TMP)
+        self.assertTrue(self.room.expire(self.room.phase_seq))
+        # tentative choice is kept
+        self.assertIsNotNone(self.room.status.get_choice(mafia.key).target)
+        self.assertTrue(self.room.done())
+
+    def test_history(self):
+        self.room.history = GameHistory(games=2, phases=3)
+        winners = []
+        for _ in range(3):
+            for target in ['ready', 'night']:
+                for user in self.room.get_user_list():
+                    self.room.choose(user.key, target, Choice.Status.FIXED)
+                self.room.proceed()
+            # mafia kills the others one by one
+            while self.room.type() != WaitingRoom:
+                mafia = next(user for user in self.room.get_user_list() if user.job.name() == 'mafia')
+                target = next(user for user in self.room.get_user_list()
+                              if user is not mafia and user.can_act())
+                for user in self.room.get_user_list():
+                    if self.room.type() == DayRoom:
+                        self.room.choose(user.key, 'night', Choice.Status.FIXED)
+                    elif user.job.name() != 'citizen':
+                        self.room.choose(user.key, target.key if user is mafia else None, Choice.Status.FIXED)
+                self.room.proceed()
+                done = self.room.game_done()
+            winners.append(done.dict())
+        history = Room.load(self.room.dump()).history
+        self.assertListEqual([game['winner'] for game in history.games], winners[1:])
+        # the earliest phases are dropped
+        self.assertEqual(len(history.games[0]['phases']), 3)
+        # games end with the night deciding them
+        last = history.games[-1]['phases'][-1]
+        self.assertEqual(last['type'], 3)
+        self.assertIsNotNone(last['result'])
+        self.assertListEqual([phase['type'] for phase in history.current], [0])
+        self.assertListEqual([game['winner'] for game in self.room.history.drain()], winners[:1])
+        self.assertListEqual(self.room.history.drain(), [])
+
+    def test_registered_job(self):
+        @register_job
+        class Guard(Citizen):
+            order = 20
+
+            def can_act(self, room_status):
+                return True
+
+            def can_target(self, user, room_status):
+                return user.can_act()
+
+            def act(self, target):
+                target.status = User.Status.SAVED
+
+        self.addCleanup(JOBS.pop, 'guard')
+        self.room.remove_job('doctor')
+        self.assertTrue(self.room.add_job('guard'))
+        for target in ['ready', 'night']:
+            for user in self.room.get_user_list():
+                self.room.choose(user.key, target, Choice.Status.FIXED)
+            self.room.proceed()
+        self.assertListEqual([job_name for job_name, _ in self.room.status.plan.steps],
+                             ['guard', 'police', 'mafia', 'citizen'])
+        mafia = next(user for user in self.room.get_user_list() if user.job.name() == 'mafia')
+        target = next(user for user in self.room.get_user_list() if user is not mafia)
+        for user in self.room.get_user_list():
+            if user.job.name() != 'citizen':
+                self.room.choose(user.key, target.key, Choice.Status.FIXED)
+        _, results = self.room.proceed()
+        # guard saves before mafia kills, only police learns something
+        self.assertEqual(target.status, User.Status.ALIVE)
+        self.assertListEqual([result.scope for result in results], ['police'])
+        self.assertListEqual([job_name for job_name, _ in Room.load(self.room.dump()).status.plan.steps],
+                             ['guard', 'police', 'mafia', 'citizen'])
+
+    def test_counters_match_rescans(self):
+        def check(room):
+            # results of rescanning every choice, as before the counters
+            status = room.status
+            choices = status.choices
+            phase = room.type()
+            if phase == NightRoom:
+                done = all(choice.fixed() for choice in choices
+                           if choice.user.can_act() and choice.user.job.can_act(status))
+            else:
+                done = all(choice.fixed() for choice in choices if choice.user.can_act())
+            self.assertEqual(room.done(), done and (phase != WaitingRoom or status.can_start()))
+            if phase in (DayRoom, ElectionRoom):
+                self.assertEqual(status.most_common(status.votes),
+                                 Counter(choice.target for choice in choices).most_common(1)[0])
+                self.assertEqual(status.active_count, len([choice for choice in choices if choice.user.can_act()]))
+            elif phase == NightRoom:
+                for job_name, job in status.plan.acting(status):
+                    targets = Counter(choice.target for choice in choices
+                                      if choice.user.job is job and choice.target is not None)
+                    votes = status.job_votes.get(job_name)
+                    self.assertEqual(status.most_common(votes)[0] if votes else None,
+                                     targets.most_common(1)[0][0] if targets else None)
+
+        rng = random.Random(6)
+        for players in [5, 8, 13]:
+            simulation = Simulation(players, seed=players)
+            for number in range(10):
+                room = simulation.new_room(number)
+                for _ in range(simulation.phase_limit):
+                    for user in list(room.get_user_list()):
+                        for target, status in simulation.bot.choices(room, user):
+                            room.choose(user.key, target, status)
+                            check(room)
+                        if room.type() != WaitingRoom and user.connected and rng.random() < 0.02:
+                            room.disconnect_user(user.key)
+                            check(room)
+                    room.proceed()
+                    check(room)
+                    if room.game_done() is not None:
+                        break
+
+    def test_group_counters(self):
+        self.assertIsNone(self.room.game_done())
+        simulation = Simulation(8, seed=3)
+        bot = RandomBot(random.Random(3))
+        for number in range(5):
+            room = simulation.new_room(number)
+            done = None
+            while done is None:
+                for user in room.get_user_list():
+                    for target, status in bot.choices(room, user):
+                        room.choose(user.key, target, status)
+                room.proceed()
+                status = room.status
+                if room.type() != WaitingRoom:
+                    for group in status.plan.groups:
+                        self.assertEqual(status.group_count(group), len(
+                            [user for user in status.users if user.can_act() and user.job.group is group]))
+                # a user left in the middle of game is counted out
+                room.disconnect_user(status.users[-1].key)
+                done = room.game_done()
+            self.assertIn(done.dict(), ['citizen_group', 'mafia_group'])
+
+    def test_replay(self):
+        bot = RandomBot(random.Random(5))
+        room = Room('replayed')
+        room.journal = []
+        for i in range(6):
+            room.add_user('key{}'.format(i), 'name{}'.format(i), 'channel{}'.format(i))
+        room.add_job('mafia')
+        room.add_job('citizen')
+        assigned = None
+        for _ in range(2):
+            while room.game_done() is None:
+                for user in room.get_user_list():
+                    for target, status in bot.choices(room, user):
+                        room.choose(user.key, target, status)
+                room.proceed()
+                if assigned is None:
+                    assigned = {user.key: user.job.name() for user in room.get_user_list()}
+        room.expire(room.phase_seq)
+
+        def state(room):
+            phases = [(phase['type'], phase['result']) for game in room.history.games for phase in game['phases']]
+            return room.status.dump(), room.phase_seq, phases
+
+        replayed = Room.replay(room.room_key, room.journal)
+        self.assertEqual(state(replayed), state(room))
+        # jobs are shuffled again with the recorded seed
+        started = next(number for number, record in enumerate(room.journal) if record[1:3] == ['proceed', 0])
+        self.assertEqual(room.journal[started][3], room.history.games[0]['seed'])
+        replayed = Room.replay(room.room_key, room.journal[:started + 1])
+        self.assertEqual(replayed.type(), DayRoom)
+        self.assertDictEqual({user.key: user.job.name() for user in replayed.get_user_list()}, assigned)
+        with self.assertRaises(ValueError):
+            Room.replay(room.room_key, [record for record in room.journal if record[1] != 'choose'])
+        with self.assertRaises(ValueError):
+            Room.replay(room.room_key, room.journal[:1] * 2)
+
+    def test_seeded_jobs(self):
+        def assigned(seed):
+            room = Room('seeded', seed=seed)
+            for i in range(8):
+                room.add_user('key{}'.format(i), 'name{}'.format(i), 'channel{}'.format(i))
+            for job in ['mafia', 'mafia', 'doctor', 'police']:
+                room.add_job(job)
+            for user in room.get_user_list():
+                room.choose(user.key, 'ready', Choice.Status.FIXED)
+            room.proceed()
+            return [user.job.name() for user in room.get_user_list()]
+
+        self.assertEqual(assigned(7), assigned(7))
+        self.assertNotEqual(assigned(7), assigned(8))
+        # games of a room follow its seed
+        bot = RandomBot(random.Random(1))
+        room = Room('seeded', seed=7)
+        for i in range(6):
+            room.add_user('key{}'.format(i), 'name{}'.format(i), 'channel{}'.format(i))
+        room.add_job('mafia')
+        room.add_job('citizen')
+        for _ in range(2):
+            while room.game_done() is None:
+                for user in room.get_user_list():
+                    for target, status in bot.choices(room, user):
+                        room.choose(user.key, target, status)
+                room.proceed()
+        self.assertEqual([game['seed'] for game in room.history.games], [7, 8])
+        self.assertEqual(RoomStatus.load(room.status.dump()).seed, 9)
+
+    def test_serialization_cache(self):
+        user = self.room.get_user('key0')
+        choice = self.room.status.get_choice('key0')
+        cached = choice.user_dict()
+        self.assertIs(choice.user_dict(), cached)
+        self.assertIs(choice.user_json(), choice.user_json())
+        changes = [
+            lambda: self.room.choose('key0', 'ready', Choice.Status.FIXED),
+            lambda: setattr(user, 'connected', False),
+            lambda: setattr(user, 'status', User.Status.DEAD),
+            lambda: setattr(user, 'name', 'renamed'),
+        ]
+        for change in changes:
+            change()
+            self.assertIsNot(choice.user_dict(), cached)
+            cached = choice.user_dict()
+        self.assertDictEqual(cached, {'id': 'key0', 'name': 'renamed', 'status': 'dead', 'connected': False,
+                                      'choice': {'target': 'ready', 'status': 'fixed'}})
+        self.assertEqual(json.loads(choice.user_json()), cached)
+        self.assertEqual(json.loads(user.json()), user.dict())
+
+    def test_user_lookup(self):
+        status = self.room.status
+        self.assertEqual(self.room.get_user('key2').name, 'name2')
+        self.assertIs(status.get_choice('key2').user, self.room.get_user('key2'))
+        self.assertIsNone(self.room.get_user(['unhashable']))
+        self.room.remove_user('key2')
+        self.assertIsNone(self.room.get_user('key2'))
+        self.assertIsNone(status.get_choice('key2'))
+        self.assertListEqual([user.key for user in status.users], ['key0', 'key1', 'key3'])
+        self.assertListEqual([choice.user.key for choice in status.choices], ['key0', 'key1', 'key3'])
+
+    def test_team_groups(self):
+        self.assertDictEqual(self.room.team_groups(), {})
+        for user in self.room.get_user_list():
+            self.room.choose(user.key, 'ready', Choice.Status.FIXED)
+        self.room.proceed()
+        groups = self.room.team_groups()
+        # citizens do not know each other
+        self.assertSetEqual(set(groups), {'room_name__mafia', 'room_name__police', 'room_name__doctor'})
+        for user in self.room.get_user_list():
+            self.assertListEqual(self.room.status.team(user), [user])
+            group = self.room.team_group(user)
+            if group is not None:
+                self.assertListEqual(groups[group], [user.channel_name])
+        # roster is rebuilt from loaded users
+        loaded = Room.load(self.room.dump())
+        self.assertDictEqual(loaded.team_groups(), groups)
@@ -0,0 +1,76 @@
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+from game.core.base import *
+from game.core.room import Room
+from game.core.room_processor import *
+from game.core.store import *
+
+
+class RoomStoreTest(TestCase):
+
+    def setUp(self):
+        self.room = Room('room_name')
+        for i in range(4):
+            self.room.add_user('key{}'.format(i), 'name{}'.format(i), 'channel{}'.format(i))
+
+    def start(self, room):
+        for user in room.get_user_list():
+            room.choose(user.key, 'ready', Choice.Status.FIXED)
+        room.result()
+        room.next_phase()
+
+    def test_dump_and_load(self):
+        self.start(self.room)
+        self.room.choose('key0', 'election', Choice.Status.FIXED)
+        loaded = Room.load(self.room.dump())
+        self.assertEqual(loaded.room_key, self.room.room_key)
+        self.assertEqual(loaded.type(), DayRoom)
+        self.assertEqual(loaded.status.type, DayRoom)
+        self.assertListEqual([phase['type'] for phase in loaded.history.current], [0, 1])
+        self.assertListEqual([user.dict() for user in loaded.get_user_list()],
+                             [user.dict() for user in self.room.get_user_list()])
+        self.assertListEqual([choice.user_dict() for choice in loaded.get_choice_list()],
+                             [choice.user_dict() for choice in self.room.get_choice_list()])
+        self.assertListEqual([user.job.name() for user in loaded.get_user_list()],
+                             [user.job.name() for user in self.room.get_user_list()])
+        # job instances are shared in a room
+        mafia = [user.job for user in loaded.get_user_list() if user.job.name() == 'mafia']
+        self.assertTrue(all(job is loaded.status.jobs['mafia']['instance'] for job in mafia))
+
+    def test_local_store(self):
+        store = LocalRoomStore()
+        async_to_sync(store.save)(self.room)
+        self.assertTrue(async_to_sync(store.exists)('room_name'))
+        room, chosen = async_to_sync(store.update)(
+            'room_name', lambda room: room.choose('key0', 'ready', Choice.Status.FIXED))
+        self.assertTrue(chosen)
+        self.assertEqual(room.version, 2)
+        loaded = async_to_sync(store.load)('room_name')
+        self.assertEqual(loaded.get_choice_list()[0].status, Choice.Status.FIXED)
+        async_to_sync(store.delete)('room_name')
+        self.assertIsNone(async_to_sync(store.load)('room_name'))
+
+    def test_version_conflict(self):
+        store = LocalRoomStore()
+        async_to_sync(store.save)(self.room)
+        first = async_to_sync(store.load)('room_name')
+        second = async_to_sync(store.load)('room_name')
+        self.assertTrue(async_to_sync(store.save)(first))
+        self.assertFalse(async_to_sync(store.save)(second))
+
+    def test_update_missing_room(self):
+        store = MemoryRoomStore()
+        with self.assertRaises(KeyError):
+            async_to_sync(store.update)('room_name', lambda room: None)
+        room, _ = async_to_sync(store.update)('room_name', lambda room: None, create=True)
+        self.assertIs(async_to_sync(store.load)('room_name'), room)
+
+    def test_unchanged_room_not_saved(self):
+        store = LocalRoomStore()
+        async_to_sync(store.save)(self.room)
+        room, result = async_to_sync(store.update)('room_name', lambda room: Unchanged('checked'))
+        self.assertEqual(result, 'checked')
+        self.assertEqual(async_to_sync(store.load)('room_name').version, 1)
+        # new room is saved anyway
+        room, _ = async_to_sync(store.update)('new_room', lambda room: Unchanged(), create=True)
+        self.assertTrue(async_to_sync(store.exists)('new_room'))
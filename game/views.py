@@ -1,4 +1,10 @@
 from django.shortcuts import render
+from game.core.identity import IDENTITY_COOKIE, IDENTITY_MAX_AGE, IDENTITY_SALT, new_user_key, read_user_key
 
 def index(request, template_name='game/index.html'):
-    return render(request, template_name, {})
+    response = render(request, template_name, {})
+    if read_user_key(request.COOKIES) is None:
+        # websocket handshakes can not set cookies, give user key here
+        response.set_signed_cookie(IDENTITY_COOKIE, new_user_key(), salt=IDENTITY_SALT,
+                                   max_age=IDENTITY_MAX_AGE, httponly=True)
+    return response
@@ -1,4 +1,4 @@
-from channels.sessions import SessionMiddlewareStack
+from channels.sessions import CookieMiddleware
 from channels.routing import ProtocolTypeRouter, URLRouter
 import game.routing
 
@@ -6,7 +6,8 @@ ASGI_APPLICATION = "mafia.routing.application"
 
 application = ProtocolTypeRouter({
     # (http->django views is added by default)
-    'websocket': SessionMiddlewareStack(
+    # identity is read from signed cookie, sessions would hit the database
+    'websocket': CookieMiddleware(
         URLRouter(
             game.routing.websocket_urlpatterns
         )
@@ -132,6 +132,37 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Room state backend
+# use game.core.store.RedisRoomStore to share rooms between daphne workers
+MAFIA_ROOM_STORE = {
+    "BACKEND": "game.core.store.MemoryRoomStore",
+    "CONFIG": {},
+}
+
+# Name and room of users to rejoin after reconnect
+# use game.core.identity.RedisIdentityStore to keep them on restart
+MAFIA_IDENTITY_STORE = {
+    "BACKEND": "game.core.identity.MemoryIdentityStore",
+    "CONFIG": {},
+}
+
+# Seconds until default choices are applied to users who did not fix theirs
+# skip election on day, abstain on election and do nothing at night, phases wait for every user when None
+# e.g. {"day": 180, "election": 60, "night": 60}
+MAFIA_PHASE_DEADLINES = None
+
+# Seconds rooms are kept without commands of their users, swept every interval, rooms are kept when None
+# e.g. {"waiting": 60 * 60, "playing": 60 * 60 * 3, "disconnected": 60 * 5, "interval": 60}
+MAFIA_ROOM_TTL = None
+
+# Callable taking room key and finished game, for games rotated out of room history
+# e.g. "game.core.history.log_archive", rotated games are dropped when None
+MAFIA_GAME_ARCHIVE = None
+
+# Directory of append-only command logs of rooms, to replay rooms from, not logged when None
+# e.g. {"directory": os.path.join(BASE_DIR, "games"), "window": 0.05}
+MAFIA_GAME_LOG = None
+
 ASGI_APPLICATION = 'mafia.routing.application'
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
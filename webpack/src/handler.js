@@ -1,5 +1,7 @@
 import app from './view'
 import VisGraph from './graph'
+import sender from './sender'
+import ws from './socket'
 import _ from 'lodash'
 
 const handler = {};
@@ -25,12 +27,20 @@ export const handled_type = [
     'main_changed',
     'room_initiated',
     'room_member_changed',
+    'room_member_refreshed',
     'game_done',
     'confirm_rejoin',
+    'room_resync',
+    'job_balance',
 ]
 
 handler.accept = (json) => {
     console.log(json);
+    // room events are numbered, skip the ones already applied by resync
+    if (json.event_seq !== undefined && json.type !== 'room_initiated') {
+        if (json.event_seq <= app.event_seq) return;
+        app.event_seq = json.event_seq;
+    }
     if (handled_type.includes(json.type)) eval(json.type)(json);
     else console.error(json);
 };
@@ -40,13 +50,46 @@ handler.accept = (json) => {
 ///////////////////////
 
 const main_initiated = (json) => {
+    app.room_list = json.room_list;
+    app.room_seq = json.seq;
+    if (ws.reconnecting && app.room !== 'main' && json.me.id === app.me.id) {
+        // connection is lost in room, keep room state and ask for missed events
+        sender.join_room(app.room, app.event_seq);
+        return;
+    }
+    ws.reconnecting = false;
+    app.event_seq = 0;
     app.clear_room_status();
     app.me = json.me;
     app.room = json.room;
 };
 
 const main_changed = (json) => {
-    app.room_list = json.room_list;
+    // full snapshot
+    if (json.room_list) {
+        app.room_list = json.room_list;
+        app.room_seq = json.seq;
+        return;
+    }
+    // missed some changes
+    if (json.seq !== app.room_seq + 1) {
+        sender.get_rooms();
+        return;
+    }
+    app.room_seq = json.seq;
+    json.changes.forEach((change) => {
+        const index = app.room_list.findIndex(it => it.name === change.name);
+        if (change.op === 'remove') {
+            if (index >= 0) app.room_list.splice(index, 1);
+        } else if (index >= 0) {
+            app.room_list[index].num = change.num;
+        } else {
+            app.room_list.push({
+                name: change.name,
+                num: change.num,
+            });
+        }
+    });
 };
 
 const main_joined = (json) => {
@@ -69,6 +112,8 @@ const main_joined = (json) => {
 };
 
 const room_initiated = (json) => {
+    ws.reconnecting = false;
+    app.event_seq = json.event_seq;
     app.room = json.room;
     app.jobs = json.jobs;
     $_set_users(json.users);
@@ -93,6 +138,12 @@ const room_initiated = (json) => {
 };
 
 const room_member_changed = (json) => {
+    json.changed.forEach(user => $_set_user(user));
+    json.removed.forEach(id => delete app.member_set[id]);
+    app.member_list = Object.values(app.member_set);
+};
+
+const room_member_refreshed = (json) => {
     $_set_users(json.users);
 };
 
@@ -117,6 +168,11 @@ const room_left = (json) => {
 };
 
 const choose_changed = (json) => {
+    if (!(json.user in app.member_set)) {
+        // missed the member, ask for every member again
+        sender.refresh_members();
+        return;
+    }
     app.member_set[json.user].choice = json.choice;
     if(app.room_status === 2) {
         app.voteMap.vote(json.user, json.choice.target, json.choice.status)
@@ -132,9 +188,14 @@ const cannot_choose = (json) => {
 
 const job_changed = (json) => {
     app.jobs = json.jobs;
+    app.balance = null;
     app.ready_msg = '';
 };
 
+const job_balance = (json) => {
+    app.balance = json.wins;
+};
+
 const job_list = (json) => {
     app.modal(json.data)
 };
@@ -213,7 +274,14 @@ const job_target_done = (json) => {
     app.block_screen(`Waiting for others (target: ${target})`);
 };
 
+const room_resync = (json) => {
+    ws.reconnecting = false;
+    json.events.forEach(handler.accept);
+};
+
 const confirm_rejoin = (json) => {
+    // already rejoining after lost connection
+    if (ws.reconnecting && app.room === json.room) return;
     if(confirm('Progressing room exists. Do you want join again?')) {
         console.log(json)
         app.join_room(json.room)        
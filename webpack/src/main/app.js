@@ -1,4 +1,7 @@
 import ws from '../socket';
 import handler, { app } from '../handler';
 
-app.socket = ws.socket(window.location.host + '/ws/', handler);
+const connect = () => {
+    app.socket = ws.socket(window.location.host + '/ws/', handler, connect);
+};
+connect();
@@ -11,7 +11,10 @@ const TYPE = {
 	GET_JOBS: 'get_jobs',
 	VOTE: 'vote',
 	TARGET: 'target',
-	CHOOSE: 'choose'
+	CHOOSE: 'choose',
+	GET_ROOMS: 'get_rooms',
+	REFRESH_MEMBERS: 'refresh_members',
+	GET_BALANCE: 'get_balance'
 };
 
 const sender = {
@@ -26,10 +29,11 @@ const sender = {
 					name: name,
 			});
 	},
-	join_room: (room) => {
+	join_room: (room, event_seq) => {
 			ws.current.send_json({
 					type: TYPE.JOIN_ROOM,
 					room: room,
+					event_seq: event_seq,
 			})
 	},
 	choose: function(target, status) {
@@ -61,6 +65,21 @@ const sender = {
 					type: TYPE.LEAVE_ROOM,
 					room: room,
 			})
+	},
+	get_rooms: function() {
+			ws.current.send_json({
+					type: TYPE.GET_ROOMS
+			});
+	},
+	refresh_members: function() {
+			ws.current.send_json({
+					type: TYPE.REFRESH_MEMBERS
+			});
+	},
+	get_balance: function() {
+			ws.current.send_json({
+					type: TYPE.GET_BALANCE
+			});
 	}
 }
 
@@ -1,6 +1,6 @@
 const ws = {};
 
-ws.socket = (url, handler) => {
+ws.socket = (url, handler, reconnect) => {
     const ws_scheme = window.location.protocol === "https:" ? "wss" : "ws";
     const socket = new WebSocket(`${ws_scheme}://${url}`);
 
@@ -8,7 +8,13 @@ ws.socket = (url, handler) => {
 
     socket.onclose = () => {
         console.error('Socket closed unexpectedly!');
-        alert('Socket closed unexpectedly!');
+        if (reconnect) {
+            // room is rejoined with missed events once connected
+            ws.reconnecting = true;
+            setTimeout(reconnect, 1000);
+        } else {
+            alert('Socket closed unexpectedly!');
+        }
     };
 
     socket.onmessage = (e) => {
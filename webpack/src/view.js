@@ -14,6 +14,8 @@ Vue.use(VueJsModal, {
 
 const status = {
     room_list: [],
+    room_seq: 0,
+    event_seq: 0,
     room_status: 0,
     room: 'main',
     status: '',
@@ -27,6 +29,7 @@ const status = {
     team_mates: {},
     edit_name: false,
     jobs: {},
+    balance: null,
     block: {
         activated: false,
         msg: null,
@@ -134,6 +137,7 @@ const app = new Vue({
             this.clear_status();
             this.me.job = null;
             this.jobs = [];
+            this.balance = null;
             this.member_list = [];
             this.member_set = {};
             this.room = 'main'